@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Group, Post
+from .models import Group, Post, TextHash
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -17,5 +17,29 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class RepeatedFilter(admin.SimpleListFilter):
+    title = 'повторы'
+    parameter_name = 'repeated'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Есть'), ('no', 'Нет'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(duplicates__gt=0)
+        if self.value() == 'no':
+            return queryset.filter(duplicates=0)
+        return queryset
+
+
+class TextHashAdmin(admin.ModelAdmin):
+    """Модерация: тексты, у которых при записи нашлись почти такие же."""
+    list_display = ('pk', 'kind', 'object_id', 'duplicates')
+    list_filter = ('kind', RepeatedFilter)
+    ordering = ('-duplicates', '-pk')
+    empty_value_display = '-пусто-'
+
+
 admin.site.register(Post,  PostAdmin)
 admin.site.register(Group,  GroupAdmin)
+admin.site.register(TextHash, TextHashAdmin)
@@ -0,0 +1,173 @@
+"""Счётчики постов и комментариев для лент.
+
+Значения лежат в кеше и поддерживаются сигналами при создании и
+удалении записей (см. signals.py). При промахе кеша счётчик один раз
+считается в БД и сохраняется, так что COUNT(*) не выполняется на
+каждый просмотр страницы.
+
+Здесь же хранятся «водяные знаки» - наибольший id поста в ленте, по
+которым опрос новых постов отвечает без обращения к БД.
+
+Сдвиг при записи виден другим процессам, только если кеш общий
+(memcached). С кешем одного процесса значения хранятся
+LOCAL_CACHE_TIMEOUT секунд, а водяным знакам не доверяют.
+"""
+from functools import partial
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, Max
+
+from .models import Comment, Follow, Group, Post
+
+SHARED_CACHE = not isinstance(caches['default'], (LocMemCache, DummyCache))
+COUNT_CACHE_TIMEOUT = (
+    settings.COUNT_CACHE_TIMEOUT if SHARED_CACHE
+    else settings.LOCAL_CACHE_TIMEOUT
+)
+
+ALL_POSTS_KEY = 'post_count:all'
+ALL_GROUPS_KEY = 'group_count:all'
+
+
+def group_key(group_id):
+    return f'post_count:group:{group_id}'
+
+
+def author_key(author_id):
+    return f'post_count:author:{author_id}'
+
+
+def follower_key(author_id):
+    return f'follower_count:author:{author_id}'
+
+
+def comment_key(post_id):
+    return f'comment_count:post:{post_id}'
+
+
+def watermark_key(scope, pk=None):
+    return f'post_watermark:{scope}:{pk}'
+
+
+def _count(key, queryset):
+    return cache.get_or_set(key, queryset.count, COUNT_CACHE_TIMEOUT)
+
+
+def _grouped_counts(key_func, ids, queryset, field, aggregate=Count('id')):
+    """Счётчики для набора id: get_many из кеша и один GROUP BY на промахи."""
+    keys = {key_func(pk): pk for pk in ids}
+    found = cache.get_many(keys)
+    counts = {keys[key]: value for key, value in found.items()}
+    missing = [pk for key, pk in keys.items() if key not in found]
+    if missing:
+        fetched = dict(
+            queryset.filter(**{f'{field}__in': missing})
+            .values_list(field)
+            .annotate(aggregate)
+            .order_by()
+        )
+        fetched = {pk: fetched.get(pk, 0) for pk in missing}
+        cache.set_many(
+            {key_func(pk): value for pk, value in fetched.items()},
+            COUNT_CACHE_TIMEOUT
+        )
+        counts.update(fetched)
+    return counts
+
+
+def post_count():
+    return _count(ALL_POSTS_KEY, Post.objects.all())
+
+
+def group_count():
+    return _count(ALL_GROUPS_KEY, Group.objects.all())
+
+
+def group_post_count(group_id):
+    return _count(group_key(group_id), Post.objects.filter(group_id=group_id))
+
+
+def author_post_count(author_id):
+    return _count(
+        author_key(author_id), Post.objects.filter(author_id=author_id)
+    )
+
+
+def author_post_counts(author_ids):
+    return _grouped_counts(author_key, author_ids, Post.objects, 'author_id')
+
+
+def group_post_counts(group_ids):
+    return _grouped_counts(group_key, group_ids, Post.objects, 'group_id')
+
+
+def follower_counts(author_ids):
+    return _grouped_counts(
+        follower_key, author_ids, Follow.objects, 'author_id'
+    )
+
+
+def comment_counts(post_ids):
+    return _grouped_counts(comment_key, post_ids, Comment.objects, 'post_id')
+
+
+def _watermark(key, queryset):
+    return cache.get_or_set(
+        key,
+        lambda: queryset.aggregate(latest=Max('id'))['latest'] or 0,
+        COUNT_CACHE_TIMEOUT
+    )
+
+
+def post_watermark():
+    return _watermark(watermark_key('all'), Post.objects.all())
+
+
+def group_watermark(group_id):
+    return _watermark(
+        watermark_key('group', group_id),
+        Post.objects.filter(group_id=group_id)
+    )
+
+
+def author_watermark(author_id):
+    return _watermark(
+        watermark_key('author', author_id),
+        Post.objects.filter(author_id=author_id)
+    )
+
+
+def follow_watermark(author_ids, group_ids):
+    """Наибольший id поста среди избранных авторов и сообществ."""
+    marks = chain(
+        _grouped_counts(
+            partial(watermark_key, 'author'), author_ids,
+            Post.objects, 'author_id', Max('id')
+        ).values(),
+        _grouped_counts(
+            partial(watermark_key, 'group'), group_ids,
+            Post.objects, 'group_id', Max('id')
+        ).values(),
+    )
+    return max(marks, default=0)
+
+
+def raise_watermarks(post):
+    keys = [watermark_key('all'), watermark_key('author', post.author_id)]
+    if post.group_id is not None:
+        keys.append(watermark_key('group', post.group_id))
+    cache.set_many({key: post.id for key in keys}, COUNT_CACHE_TIMEOUT)
+
+
+def change(keys, delta):
+    """Сдвигает уже посчитанные счётчики; отсутствующие в кеше
+    досчитаются при следующем чтении."""
+    for key in keys:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            pass
@@ -0,0 +1,67 @@
+"""Каталог сообществ: сохранённые в Group агрегаты.
+
+post_count, last_activity и subscriber_count обновляются одним UPDATE
+при записи постов и подписок, так что страница каталога - один запрос
+без JOIN и GROUP BY. Если счётчики разошлись (например, после правки
+через админку), их пересчитывает команда rebuild_group_directory.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Group, GroupFollow, Post
+
+
+def aggregates():
+    """Выражения для пересчёта всех агрегатов одним UPDATE."""
+    posts = Post.objects.filter(group=OuterRef('pk')).order_by()
+    subscribers = GroupFollow.objects.filter(
+        group=OuterRef('pk')
+    ).order_by()
+    return {
+        'post_count': Coalesce(Subquery(
+            posts.values('group').annotate(total=Count('id')).values('total')
+        ), 0),
+        'last_activity': Subquery(
+            posts.order_by('-pub_date').values('pub_date')[:1]
+        ),
+        'subscriber_count': Coalesce(Subquery(
+            subscribers.values('group').annotate(
+                total=Count('id')
+            ).values('total')
+        ), 0),
+    }
+
+
+def rebuild():
+    return Group.objects.update(**aggregates())
+
+
+def add_post(post):
+    Group.objects.filter(pk=post.group_id).update(
+        post_count=F('post_count') + 1, last_activity=post.pub_date
+    )
+
+
+def remove_post(group_id):
+    """Пост удалён из сообщества: последняя активность - по
+    оставшимся постам через индекс (group, -pub_date)."""
+    Group.objects.filter(pk=group_id).update(
+        post_count=F('post_count') - 1,
+        last_activity=aggregates()['last_activity'],
+    )
+
+
+def move_post(post, old_group_id):
+    if old_group_id is not None:
+        remove_post(old_group_id)
+    if post.group_id is not None:
+        Group.objects.filter(pk=post.group_id).update(
+            post_count=F('post_count') + 1,
+            last_activity=aggregates()['last_activity'],
+        )
+
+
+def change_subscribers(group_id, delta):
+    Group.objects.filter(pk=group_id).update(
+        subscriber_count=F('subscriber_count') + delta
+    )
@@ -0,0 +1,95 @@
+"""Поиск повторно загруженных картинок по перцептивному хешу.
+
+Индекс с несколькими ключами: 64-битный хеш разбит на четыре полосы по
+16 бит, и у каждой полосы свой индекс. У хешей на расстоянии Хэмминга
+не больше 3 по принципу Дирихле хотя бы одна полоса совпадает, поэтому
+кандидаты выбираются по индексам, а не перебором всей таблицы, и точное
+расстояние считается только для них. Для кластеризации всего корпуса
+корзины дробятся ещё и по частям оставшихся бит (bucket_keys), иначе
+одна популярная полоса давала бы квадратичный перебор.
+"""
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .images import BAND_BITS, HASH_BANDS, hash_bands, to_unsigned
+from .models import ImageHash
+
+MAX_DISTANCE = HASH_BANDS - 1
+PIECE_BITS = BAND_BITS * (HASH_BANDS - 1) // HASH_BANDS
+PIECE_MASK = (1 << PIECE_BITS) - 1
+
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+
+def similar_images(value, max_distance=MAX_DISTANCE, exclude_post=None):
+    """Id постов с картинками, похожими на хеш ``value``."""
+    query = Q()
+    for band, part in enumerate(hash_bands(value)):
+        query |= Q(**{f'band_{band}': part})
+    candidates = ImageHash.objects.filter(query)
+    if exclude_post is not None:
+        candidates = candidates.exclude(post_id=exclude_post)
+    return [
+        post_id
+        for post_id, other in candidates.values_list('post_id', 'value')
+        if hamming(value, to_unsigned(other)) <= max_distance
+    ]
+
+
+def bucket_keys(value):
+    """Ключи корзин для поиска пар: полоса хеша и одна из четырёх
+    12-битных частей остальных 48 бит. У хешей на расстоянии не больше
+    3 совпадают какая-то полоса и, по тому же принципу Дирихле, какая-то
+    часть остатка, а случайных соседей в такой корзине в 2^12 раз
+    меньше, чем в корзине одной полосы."""
+    for band, part in enumerate(hash_bands(value)):
+        low = value & ((1 << BAND_BITS * band) - 1)
+        rest = low | value >> BAND_BITS * (band + 1) << BAND_BITS * band
+        for piece in range(HASH_BANDS):
+            yield band, part, piece, rest >> PIECE_BITS * piece & PIECE_MASK
+
+
+def duplicate_clusters(hashes, max_distance=MAX_DISTANCE):
+    """Группы ключей ``hashes`` с похожими хешами.
+
+    ``hashes`` - словарь id -> хеш. Одинаковые хеши объединяются сразу,
+    остальные пары ищутся внутри корзин bucket_keys, группы собираются
+    системой непересекающихся множеств."""
+    parent = {key: key for key in hashes}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    by_value = {}
+    for key, value in hashes.items():
+        if value in by_value:
+            parent[find(key)] = find(by_value[value])
+        else:
+            by_value[value] = key
+    buckets = defaultdict(list)
+    for value in by_value:
+        for bucket in bucket_keys(value):
+            buckets[bucket].append(value)
+    for members in buckets.values():
+        for position, first in enumerate(members):
+            for second in members[position + 1:]:
+                first_key, second_key = by_value[first], by_value[second]
+                if find(first_key) == find(second_key):
+                    continue
+                if hamming(first, second) <= max_distance:
+                    parent[find(second_key)] = find(first_key)
+
+    clusters = defaultdict(list)
+    for key in hashes:
+        clusters[find(key)].append(key)
+    return sorted(
+        (sorted(members) for members in clusters.values()
+         if len(members) > 1),
+        key=len, reverse=True
+    )
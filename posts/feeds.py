@@ -0,0 +1,196 @@
+from django.conf import settings
+from django.db import connection
+
+from .counters import comment_counts
+from .models import Comment, Post, User
+
+COMMENT_PREVIEWS = settings.COMMENT_PREVIEWS
+IMAGE_FIELD = Post._meta.get_field('image')
+
+# Колонки, которые нужны карточке поста в лентах (post_item.html)
+FEED_COLUMNS = (
+    'id', 'preview_html', 'pub_date', 'image', 'image_placeholder',
+    'author_id', 'author__username',
+    'author__first_name', 'author__last_name',
+    'group__slug', 'group__title',
+)
+
+
+class FeedAuthor:
+    __slots__ = ('id', 'username', 'first_name', 'last_name', 'following')
+
+    def __init__(self, id, username, first_name, last_name):
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.following = False
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_full_name(self):
+        return f'{self.first_name} {self.last_name}'.strip()
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.username
+
+
+class FeedGroup:
+    __slots__ = ('slug', 'title')
+
+    def __init__(self, slug, title):
+        self.slug = slug
+        self.title = title
+
+    def __str__(self):
+        return self.title
+
+
+class FeedPost:
+    """Облегчённая строка ленты вместо полного экземпляра Post."""
+
+    __slots__ = (
+        'id', 'preview_html', 'pub_date', 'image', 'image_placeholder',
+        'author', 'group', 'comment_count', 'latest_comments',
+    )
+
+    def __init__(self, id, preview_html, pub_date, image, image_placeholder,
+                 author_id, username, first_name, last_name, group_slug,
+                 group_title):
+        self.id = id
+        self.preview_html = preview_html
+        self.pub_date = pub_date
+        # файл поля, как у Post.image: миниатюры ленты хранятся в KVStore
+        # под тем же ключом с хранилищем поля, который проверяет
+        # collect_media_garbage
+        self.image = IMAGE_FIELD.attr_class(None, IMAGE_FIELD, image)
+        self.image_placeholder = image_placeholder
+        self.author = FeedAuthor(author_id, username, first_name, last_name)
+        self.group = (
+            FeedGroup(group_slug, group_title) if group_slug else None
+        )
+        self.comment_count = 0
+        self.latest_comments = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, (FeedPost, Post)):
+            return other.pk == self.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return f'Post #{self.id}'
+
+
+class FeedComment:
+    __slots__ = ('id', 'post_id', 'username', 'preview_html')
+
+    def __init__(self, id, post_id, username, preview_html):
+        self.id = id
+        self.post_id = post_id
+        self.username = username
+        self.preview_html = preview_html
+
+
+def load_feed_rows(queryset, with_comments=False):
+    """Одним запросом (с JOIN автора и группы) строит строки ленты."""
+    rows = [
+        FeedPost(*values)
+        for values in queryset.values_list(*FEED_COLUMNS)
+    ]
+    attach_comment_counts(rows)
+    if with_comments:
+        attach_latest_comments(rows)
+    return rows
+
+
+def attach_comment_counts(rows):
+    counts = comment_counts([row.id for row in rows])
+    for row in rows:
+        row.comment_count = counts[row.id]
+
+
+LATEST_COMMENTS_SQL = '''
+    SELECT id, post_id, username, preview_html FROM (
+        SELECT c.id, c.post_id, u.username, c.preview_html,
+               ROW_NUMBER() OVER (
+                   PARTITION BY c.post_id
+                   ORDER BY c.created DESC, c.id DESC
+               ) AS position
+        FROM {comments} c
+        JOIN {users} u ON u.id = c.author_id
+        WHERE c.post_id IN ({post_ids})
+    ) latest
+    WHERE position <= %s
+    ORDER BY post_id, position
+'''
+
+
+def attach_latest_comments(rows, limit=COMMENT_PREVIEWS):
+    """Последние комментарии ко всем постам страницы одним запросом:
+    ROW_NUMBER() по комментариям, разбитым по post_id."""
+    by_id = {row.id: row for row in rows if row.comment_count}
+    if not by_id:
+        return
+    sql = LATEST_COMMENTS_SQL.format(
+        comments=Comment._meta.db_table,
+        users=User._meta.db_table,
+        post_ids=', '.join(['%s'] * len(by_id)),
+    )
+    latest = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*by_id, limit])
+        for values in cursor.fetchall():
+            comment = FeedComment(*values)
+            latest.setdefault(comment.post_id, []).append(comment)
+    for post_id, comments in latest.items():
+        by_id[post_id].latest_comments = comments
+
+
+class FeedRows:
+    """Ленивая обёртка над QuerySet для Paginator.
+
+    Paginator берёт у неё count() и срез, а срез превращается в
+    список FeedPost вместо экземпляров модели.
+    """
+
+    def __init__(self, queryset, with_comments=False):
+        self.queryset = queryset
+        self.with_comments = with_comments
+
+    @property
+    def ordered(self):
+        return self.queryset.ordered
+
+    def count(self):
+        return self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __contains__(self, post):
+        return self.queryset.filter(pk=post.pk).exists()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return load_feed_rows(self.queryset[key], self.with_comments)
+        return load_feed_rows(
+            self.queryset[key:key + 1], self.with_comments
+        )[0]
+
+    def __iter__(self):
+        return iter(load_feed_rows(self.queryset, self.with_comments))
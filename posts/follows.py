@@ -0,0 +1,197 @@
+"""Подписки пользователя на авторов.
+
+Множество id авторов, на которых подписан пользователь, кешируется
+целиком и сбрасывается при подписке и отписке. Состояние кнопок
+«Подписаться» для всех авторов страницы определяется одной выборкой
+из кеша (или одним запросом при промахе).
+
+Подписка - один INSERT ... ON CONFLICT DO NOTHING, отписка - один
+DELETE, и оба через RETURNING сообщают, какие строки действительно
+изменились: по ним, а не по кешу, который мог устареть, меняются
+счётчики подписчиков. Где RETURNING нет (SQLite старше 3.35, MySQL),
+изменения считаются выборкой внутри транзакции под блокировкой строки
+пользователя - это лишние запрос и блокировка, но тот же результат.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import counters, timeline
+from .models import Follow, FollowSuggestion
+
+FOLLOW_SUGGESTIONS = settings.FOLLOW_SUGGESTIONS
+FOLLOW_SUGGESTIONS_STORED = settings.FOLLOW_SUGGESTIONS_STORED
+
+
+def followed_key(user_id):
+    return f'followed_authors:user:{user_id}'
+
+
+def followed_author_ids(user_id):
+    return cache.get_or_set(
+        followed_key(user_id),
+        lambda: frozenset(
+            Follow.objects.filter(user_id=user_id).values_list(
+                'author_id', flat=True
+            )
+        ),
+        counters.COUNT_CACHE_TIMEOUT
+    )
+
+
+def following_ids(user, author_ids):
+    """Те из ``author_ids``, на кого подписан ``user``."""
+    if not user.is_authenticated:
+        return set()
+    return followed_author_ids(user.id).intersection(author_ids)
+
+
+def mark_following(rows, user):
+    """Проставляет author.following строкам ленты одной проверкой."""
+    followed = following_ids(user, {row.author.id for row in rows})
+    for row in rows:
+        row.author.following = row.author.id in followed
+
+
+def forget_followed(user_id):
+    cache.delete(followed_key(user_id))
+
+
+def _returning_supported():
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35, 0)
+    )
+
+
+INSERT_SQL = '''
+    INSERT INTO {table} (user_id, author_id) VALUES {values}
+    ON CONFLICT DO NOTHING RETURNING author_id
+'''
+DELETE_SQL = '''
+    DELETE FROM {table} WHERE user_id = %s AND author_id IN ({ids})
+    RETURNING author_id
+'''
+RETURNING = _returning_supported()
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _insert(user, author_ids):
+    """Вставляет подписки и возвращает id авторов реально вставленных
+    строк: одним INSERT ... ON CONFLICT DO NOTHING RETURNING, а без
+    RETURNING - выборкой существующих под блокировкой пользователя."""
+    author_ids = sorted(author_ids)
+    if RETURNING:
+        return _execute(
+            INSERT_SQL.format(
+                table=connection.ops.quote_name(Follow._meta.db_table),
+                values=', '.join(['(%s, %s)'] * len(author_ids)),
+            ),
+            [param for pk in author_ids for param in (user.id, pk)]
+        )
+    _lock_follows(user)
+    added = set(author_ids) - set(
+        Follow.objects.filter(
+            user=user, author_id__in=author_ids
+        ).values_list('author_id', flat=True)
+    )
+    Follow.objects.bulk_create(
+        [Follow(user=user, author_id=author_id) for author_id in added],
+        ignore_conflicts=True
+    )
+    return added
+
+
+def _delete(user, author_ids):
+    """Удаляет подписки и возвращает id авторов удалённых строк."""
+    author_ids = sorted(author_ids)
+    if RETURNING:
+        return _execute(
+            DELETE_SQL.format(
+                table=connection.ops.quote_name(Follow._meta.db_table),
+                ids=', '.join(['%s'] * len(author_ids)),
+            ),
+            [user.id, *author_ids]
+        )
+    _lock_follows(user)
+    removed = set(
+        Follow.objects.filter(
+            user=user, author_id__in=author_ids
+        ).values_list('author_id', flat=True)
+    )
+    Follow.objects.filter(user=user, author_id__in=removed).delete()
+    return removed
+
+
+def _lock_follows(user):
+    """Блокирует строку пользователя до конца транзакции, чтобы его
+    параллельные подписки не посчитали одно изменение дважды."""
+    list(get_user_model().objects.select_for_update().filter(
+        pk=user.pk
+    ).values_list('pk', flat=True))
+
+
+def _changed(user, author_ids, delta):
+    """Сбрасывает кеш подписок и меняет счётчики подписчиков.
+
+    Кеш сбрасывается сразу и ещё раз после коммита: чтение внутри
+    транзакции могло положить в него незакоммиченное множество.
+    Счётчики меняются только после коммита, чтобы откат транзакции
+    их не испортил."""
+    forget_followed(user.id)
+    keys = [counters.follower_key(pk) for pk in author_ids]
+
+    def update():
+        forget_followed(user.id)
+        counters.change(keys, delta)
+    transaction.on_commit(update)
+
+
+def follow(user, author_ids):
+    """Подписывает ``user`` на авторов; повторная подписка ничего не
+    меняет. Возвращает множество новых подписок."""
+    author_ids = set(author_ids) - {user.id}
+    if not author_ids:
+        return set()
+    with transaction.atomic():
+        added = _insert(user, author_ids)
+        timeline.backfill(user, added)
+        _changed(user, added, 1)
+    return added
+
+
+def unfollow(user, author_ids):
+    """Отписывает ``user`` от авторов. Возвращает множество отписок."""
+    author_ids = set(author_ids)
+    if not author_ids:
+        return set()
+    with transaction.atomic():
+        removed = _delete(user, author_ids)
+        timeline.forget(user, removed)
+        _changed(user, removed, -1)
+    return removed
+
+
+def suggested_authors(user, limit=FOLLOW_SUGGESTIONS):
+    """Рекомендованные авторы из ночного расчёта (см. suggestions.py)
+    одним чтением по индексу (user, -score). Авторы, на которых
+    пользователь подписался после расчёта, пропускаются."""
+    if not user.is_authenticated:
+        return []
+    followed = followed_author_ids(user.id)
+    suggestions = FollowSuggestion.objects.filter(
+        user=user
+    ).select_related('author').order_by('-score')
+    return [
+        suggestion.author
+        for suggestion in suggestions[:FOLLOW_SUGGESTIONS_STORED]
+        if suggestion.author_id not in followed
+    ][:limit]
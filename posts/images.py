@@ -0,0 +1,87 @@
+"""Размеры, крошечное превью и перцептивный хеш картинки поста,
+считаемые при загрузке.
+
+Превью - PNG не больше PREVIEW_SIZE точек по большей стороне (обычно
+200-300 байт), которое шаблон вставляет как data: URI фоном под
+настоящую картинку с loading="lazy". Лента рисуется сразу, а картинки
+ниже первого экрана грузятся только при прокрутке.
+
+Хеш - 64-битный dHash, по которому ищутся повторно загруженные
+картинки (см. duplicates.py).
+"""
+import base64
+import io
+
+from PIL import Image
+
+PREVIEW_SIZE = 16
+HASH_SIZE = 8
+HASH_BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def perceptual_hash(image):
+    """dHash: для картинки 9x8 в оттенках серого по биту на каждую
+    точку - светлее ли она соседки справа. Пересжатие, масштаб и
+    небольшие правки меняют лишь несколько бит."""
+    small = image.convert('L').resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR
+    )
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            value = value << 1 | (left > pixels[
+                row * (HASH_SIZE + 1) + column + 1
+            ])
+    return value
+
+
+def hash_bands(value):
+    """Четыре 16-битные полосы хеша: у хешей на расстоянии Хэмминга
+    не больше 3 хотя бы одна полоса совпадает целиком."""
+    return [(value >> (BAND_BITS * band)) & BAND_MASK
+            for band in range(HASH_BANDS)]
+
+
+def to_signed(value):
+    """64-битный хеш в диапазон BigIntegerField."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value & (1 << 64) - 1
+
+
+def describe(file):
+    """(ширина, высота, data: URI превью, перцептивный хеш) или None,
+    если файл - не картинка."""
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            width, height = image.size
+            # JPEG декодируется сразу в уменьшенном масштабе
+            image.draft('RGB', (PREVIEW_SIZE * 8, PREVIEW_SIZE * 8))
+            image_hash = perceptual_hash(image)
+            preview = image.convert('RGB')
+            preview.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+            buffer = io.BytesIO()
+            preview.save(buffer, 'PNG', optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return width, height, f'data:image/png;base64,{encoded}', image_hash
+
+
+def hash_path(path):
+    """Хеш картинки по пути к файлу; для пула процессов."""
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+            return perceptual_hash(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
@@ -0,0 +1,132 @@
+"""Рассылка новых комментариев открытым страницам постов (SSE).
+
+Один фоновый поток на процесс раз в LIVE_COMMENTS_INTERVAL секунд
+одним запросом выбирает новые комментарии ко всем постам, которые
+сейчас кто-то смотрит, один раз рендерит каждый фрагмент и раскладывает
+его по очередям подписчиков. Число запросов к БД не зависит от числа
+открытых соединений.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.template.loader import render_to_string
+
+from .models import Comment
+
+INTERVAL = settings.LIVE_COMMENTS_INTERVAL
+COMMENT_TEMPLATE = 'posts/includes/comment_item.html'
+
+logger = logging.getLogger(__name__)
+
+
+def render_comment(comment):
+    return render_to_string(COMMENT_TEMPLATE, {'item': comment})
+
+
+class CommentBroadcaster:
+
+    def __init__(self, interval=INTERVAL, autostart=True):
+        self.interval = interval
+        self.autostart = autostart
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.last_id = 0
+        self.thread = None
+
+    def subscribe(self, post_id):
+        listener = queue.Queue()
+        with self.lock:
+            if not self.subscribers:
+                # пока подписчиков не было, last_id не двигался: первый
+                # подписчик начинает с текущего комментария, а пропущенное
+                # при переподключении дочитывается по Last-Event-ID.
+                # MAX по первичному ключу - один шаг по индексу, так что
+                # его можно сделать под блокировкой
+                self.last_id = Comment.objects.aggregate(
+                    latest=Max('id')
+                )['latest'] or 0
+            self.subscribers.setdefault(post_id, set()).add(listener)
+            if self.autostart and self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='comment-broadcaster', daemon=True
+                )
+                self.thread.start()
+        return listener
+
+    def unsubscribe(self, post_id, listener):
+        with self.lock:
+            listeners = self.subscribers.get(post_id, set())
+            listeners.discard(listener)
+            if not listeners:
+                self.subscribers.pop(post_id, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll_once()
+            except Exception:
+                # ошибка БД (например, «database is locked») не должна
+                # останавливать рассылку до перезапуска процесса
+                logger.exception('Live comments poll failed')
+            finally:
+                close_old_connections()
+
+    def poll_once(self):
+        with self.lock:
+            post_ids = list(self.subscribers)
+            last_id = self.last_id
+        if not post_ids:
+            return
+        comments = Comment.objects.filter(
+            id__gt=last_id, post_id__in=post_ids
+        ).select_related('author').order_by('id')
+        for comment in comments:
+            self.publish(comment.post_id, comment.id, render_comment(comment))
+            with self.lock:
+                self.last_id = comment.id
+
+    def publish(self, post_id, comment_id, fragment):
+        with self.lock:
+            listeners = list(self.subscribers.get(post_id, ()))
+        for listener in listeners:
+            listener.put((comment_id, fragment))
+
+
+broadcaster = CommentBroadcaster()
+
+
+def sse_event(event, event_id, data):
+    lines = ''.join(f'data: {line}\n' for line in data.splitlines())
+    return f'event: {event}\nid: {event_id}\n{lines}\n'
+
+
+def comment_events(post_id, last_event_id=None, keepalive=15):
+    """Поток событий SSE для страницы поста."""
+    listener = broadcaster.subscribe(post_id)
+    try:
+        yield f'retry: {int(INTERVAL * 1000)}\n\n'
+        if last_event_id is not None:
+            # переподключившийся клиент получает пропущенные комментарии
+            missed = Comment.objects.filter(
+                post_id=post_id, id__gt=last_event_id
+            ).select_related('author').order_by('id')
+            for comment in missed:
+                yield sse_event(
+                    'comment', comment.id, render_comment(comment)
+                )
+            close_old_connections()
+        while True:
+            try:
+                comment_id, fragment = listener.get(timeout=keepalive)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield sse_event('comment', comment_id, fragment)
+    finally:
+        broadcaster.unsubscribe(post_id, listener)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Post
+from posts.text import (extract_mentions, render_preview, render_text,
+                        resolve_mentions)
+
+FIELDS = ['text_html', 'preview_html']
+
+
+class Command(BaseCommand):
+    help = (
+        'Перерисовывает посты и комментарии с @упоминаниями, написанные '
+        'до появления ссылок на профили. Пользователи ищутся одним '
+        'запросом на пачку. Новые тексты разбираются при сохранении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = self.rerender(Post, batch_size, tags=True)
+        comments = self.rerender(Comment, batch_size, tags=False)
+        self.stdout.write(f'posts={posts} comments={comments}')
+
+    def rerender(self, model, batch_size, tags):
+        # без "@" в тексте упоминаний нет и HTML не изменится
+        rows = model.objects.filter(text__contains='@').only(
+            'id', 'text'
+        ).order_by('pk')
+        last_id = 0
+        rendered = 0
+        while True:
+            batch = list(rows.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return rendered
+            last_id = batch[-1].pk
+            mentions = resolve_mentions(sorted({
+                name for row in batch for name in extract_mentions(row.text)
+            }))
+            for row in batch:
+                row.text_html = render_text(row.text, mentions, tags)
+                row.preview_html = render_preview(row.text, mentions, tags)
+            model.objects.bulk_update(batch, FIELDS)
+            rendered += len(batch)
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Comment, Post, PostTag
+from posts.tags import tag_ids
+from posts.text import (extract_mentions, extract_tags, render_preview,
+                        render_text, resolve_mentions)
+
+FIELDS = ['text_html', 'preview_html']
+
+
+class Command(BaseCommand):
+    help = (
+        'Разбирает теги в постах, написанных до появления тегов: '
+        'заполняет Tag и PostTag и перерисовывает текст со ссылками на '
+        'теги. Новые посты разбираются при сохранении. Комментарии с '
+        '#тегами перерисовываются без ссылок: теги комментариев не '
+        'индексируются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.only('id', 'text', 'pub_date').order_by('pk')
+        last_id = 0
+        scanned = tagged = links = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_id)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            scanned += len(batch)
+            names = {post: extract_tags(post.text) for post in batch}
+            tagged_posts = [post for post in batch if names[post]]
+            ids = tag_ids(sorted({
+                name for post in tagged_posts for name in names[post]
+            }))
+            created = PostTag.objects.bulk_create(
+                [
+                    PostTag(
+                        tag_id=ids[name], post_id=post.pk,
+                        pub_date=post.pub_date
+                    )
+                    for post in tagged_posts for name in names[post]
+                ],
+                ignore_conflicts=True
+            )
+            mentions = resolve_mentions(sorted({
+                name for post in tagged_posts
+                for name in extract_mentions(post.text)
+            }))
+            for post in tagged_posts:
+                post.text_html = render_text(post.text, mentions)
+                post.preview_html = render_preview(post.text, mentions)
+            Post.objects.bulk_update(tagged_posts, FIELDS)
+            tagged += len(tagged_posts)
+            links += len(created)
+        comments = self.rerender_comments(options['batch_size'])
+        self.stdout.write(
+            f'posts={scanned} tagged={tagged} links={links} '
+            f'comments={comments}'
+        )
+
+    def rerender_comments(self, batch_size):
+        comments = Comment.objects.filter(text__contains='#').only(
+            'id', 'text'
+        ).order_by('pk')
+        last_id = 0
+        rendered = 0
+        while True:
+            batch = list(comments.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return rendered
+            last_id = batch[-1].pk
+            mentions = resolve_mentions(sorted({
+                name for comment in batch
+                for name in extract_mentions(comment.text)
+            }))
+            for comment in batch:
+                comment.text_html = render_text(
+                    comment.text, mentions, tags=False
+                )
+                comment.preview_html = render_preview(
+                    comment.text, mentions, tags=False
+                )
+            Comment.objects.bulk_update(batch, FIELDS)
+            rendered += len(batch)
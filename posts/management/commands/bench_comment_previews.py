@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from posts.feeds import COMMENT_PREVIEWS, attach_latest_comments
+from posts.models import Comment, Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает загрузку последних комментариев для страницы ленты: '
+        'запрос на каждый пост против одного запроса с ROW_NUMBER().'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10)
+        parser.add_argument('--comments', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Тестовые данные создаются внутри транзакции и откатываются
+        with transaction.atomic():
+            rows = self.create_page(options['posts'], options['comments'])
+            for name, load in (
+                ('naive', self.load_naive),
+                ('window', attach_latest_comments),
+            ):
+                queries, elapsed = self.measure(load, rows, options['repeat'])
+                self.stdout.write(
+                    f'{name:>6}: {queries} queries/page, '
+                    f'{elapsed * 1000:.2f} ms/page'
+                )
+            transaction.set_rollback(True)
+
+    def create_page(self, posts, comments):
+        user = User.objects.create(username='bench-comment-previews')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=user) for i in range(posts)
+        )
+        page = list(Post.objects.filter(author=user))
+        Comment.objects.bulk_create(
+            Comment(post=post, author=user, text=f'Комментарий {i}')
+            for post in page for i in range(comments)
+        )
+        for post in page:
+            post.comment_count = comments
+            post.latest_comments = ()
+        return page
+
+    def load_naive(self, rows):
+        for row in rows:
+            row.latest_comments = list(
+                row.comments.select_related('author')[:COMMENT_PREVIEWS]
+            )
+
+    def measure(self, load, rows, repeat):
+        with CaptureQueriesContext(connection) as context:
+            load(rows)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            load(rows)
+        elapsed = (time.perf_counter() - start) / repeat
+        return len(context.captured_queries), elapsed
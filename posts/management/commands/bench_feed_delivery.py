@@ -0,0 +1,81 @@
+import bisect
+import random
+from collections import Counter
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Моделирует доставку ленты подписок на графе подписок с '
+        'распределением Ципфа: сколько строк TimelineEntry пишется на '
+        'один пост и сколько потоков читается на одну ленту при push, '
+        'pull и гибридной схеме с разными порогами. Как в timeline.py, '
+        'гибридное чтение - push-лента и потоки только тех избранных '
+        'авторов, у кого есть неразосланные посты, то есть выше порога.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--follows', type=int, default=50,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--exponent', type=float, default=1.1)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--reads', type=int, default=20000)
+        parser.add_argument(
+            '--thresholds', type=int, nargs='*',
+            default=[100, 1000, settings.FEED_CELEBRITY_FOLLOWERS],
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        users = options['users']
+        weights = list(accumulate(
+            1 / rank ** options['exponent'] for rank in range(1, users + 1)
+        ))
+
+        def zipf():
+            return bisect.bisect(weights, rnd.random() * weights[-1])
+
+        followees = [
+            {zipf() for _ in range(options['follows'])}
+            for _ in range(users)
+        ]
+        followers = Counter(
+            author for authors in followees for author in authors
+        )
+        self.stdout.write(
+            f'users={users} follows={sum(map(len, followees))} '
+            f'max followers={max(followers.values())}'
+        )
+
+        posting = [zipf() for _ in range(options['posts'])]
+        reading = [rnd.randrange(users) for _ in range(options['reads'])]
+        schemes = [('push', float('inf')), ('pull', 0)] + [
+            (f'hybrid@{threshold}', threshold)
+            for threshold in options['thresholds']
+        ]
+        self.stdout.write(
+            f'{"scheme":>14} {"rows/post":>10} {"max rows":>9} '
+            f'{"streams/read":>13} {"max streams":>12}'
+        )
+        for name, threshold in schemes:
+            writes = [
+                followers[author] if followers[author] < threshold else 0
+                for author in posting
+            ]
+            reads = [
+                sum(
+                    1 for author in followees[user]
+                    if followers[author] >= threshold
+                ) + (threshold > 0)
+                for user in reading
+            ]
+            self.stdout.write(
+                f'{name:>14} {sum(writes) / len(writes):>10.1f} '
+                f'{max(writes):>9} {sum(reads) / len(reads):>13.2f} '
+                f'{max(reads):>12}'
+            )
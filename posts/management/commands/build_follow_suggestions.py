@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import FollowSuggestion
+from posts.precomputed import replace_rows
+from posts.suggestions import BLOCK_SIZE, COFOLLOW_WEIGHT, compute_suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рекомендации «на кого подписаться» по всему графу '
+        'подписок и заменяет ими таблицу FollowSuggestion. Запускается '
+        'раз в сутки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=settings.FOLLOW_SUGGESTIONS_STORED,
+            help='Сколько кандидатов хранить на пользователя'
+        )
+        parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+        parser.add_argument(
+            '--cofollow-weight', type=float, default=COFOLLOW_WEIGHT
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        suggestions = compute_suggestions(
+            options['limit'], options['block_size'],
+            options['cofollow_weight']
+        )
+        written = replace_rows(FollowSuggestion, 'user', suggestions)
+        self.stdout.write(
+            f'suggestions={written} '
+            f'time={time.perf_counter() - started:.1f}s'
+        )
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import RelatedPost
+from posts.precomputed import replace_rows
+from posts.related import BLOCK_SIZE, MAX_DF, MIN_SCORE, compute_related
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие посты по TF-IDF текстов и заменяет ими '
+        'таблицу RelatedPost. Запускается раз в сутки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=settings.RELATED_POSTS,
+            help='Сколько похожих постов хранить на пост'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=BLOCK_SIZE,
+            help='Строк в блоке произведения: память под оценки блока '
+                 'растёт пропорционально'
+        )
+        parser.add_argument(
+            '--max-df', type=float, default=MAX_DF,
+            help='Слова из большей доли постов не учитываются'
+        )
+        parser.add_argument('--min-score', type=float, default=MIN_SCORE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        related = compute_related(
+            options['limit'], options['block_size'], options['max_df'],
+            options['min_score']
+        )
+        written = replace_rows(RelatedPost, 'post', related)
+        self.stdout.write(
+            f'related={written} time={time.perf_counter() - started:.1f}s'
+        )
@@ -0,0 +1,45 @@
+import os
+import re
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.staticfiles import ENCODERS
+
+SUFFIXES = tuple(suffix for _, suffix, _ in ENCODERS)
+# копии с хешем из прошлых сборок, в том числе промежуточные
+HASHED = re.compile(r'\.[0-9a-f]{12}(\.|$)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Добавляет хеш содержимого к именам файлов в STATIC_ROOT, '
+        'сохраняет рядом сжатые копии и записывает манифест, по '
+        'которому статику раздаёт StaticFilesMiddleware.'
+    )
+
+    def source_paths(self, storage):
+        for root, _, files in os.walk(storage.location):
+            for filename in files:
+                if filename == storage.manifest_name:
+                    continue
+                if HASHED.search(filename) or filename.endswith(SUFFIXES):
+                    continue
+                yield os.path.relpath(
+                    os.path.join(root, filename), storage.location
+                ).replace(os.sep, '/')
+
+    def handle(self, *args, **options):
+        storage = staticfiles_storage
+        paths = {path: (storage, path) for path in self.source_paths(storage)}
+        for name, _, processed in storage.post_process(paths):
+            if isinstance(processed, Exception):
+                raise CommandError(f'{name}: {processed}')
+        variants = sum(
+            1 for name in storage.hashed_files.values()
+            for suffix in SUFFIXES if storage.exists(name + suffix)
+        )
+        self.stdout.write(
+            f'files={len(paths)} compressed={variants} '
+            f'manifest={storage.manifest_name}'
+        )
@@ -0,0 +1,142 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post
+
+
+def scan(directory):
+    """Файлы каталога и подкаталогов через os.scandir, без списка
+    всего дерева в памяти."""
+    stack = [directory]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _kv_values(keys, identity):
+    rows = KVStore.objects.filter(
+        key__in=[add_prefix(key, identity) for key in keys]
+    ).values_list('value', flat=True)
+    return [json.loads(value) for value in rows]
+
+
+def live_thumbnails(batch_size):
+    """Имена миниатюр, которые sorl-thumbnail хранит для картинок
+    существующих постов: два запроса к KVStore на пачку постов."""
+    storage = Post._meta.get_field('image').storage
+    names = Post.objects.exclude(image='').exclude(
+        image__isnull=True
+    ).values_list('image', flat=True).distinct()
+    live = set()
+    for batch in batched(names.iterator(), batch_size):
+        sources = [ImageFile(name, storage).key for name in batch]
+        thumbnail_keys = [
+            key for keys in _kv_values(sources, 'thumbnails') for key in keys
+        ]
+        for start in range(0, len(thumbnail_keys), batch_size):
+            live.update(
+                image['name'] for image in _kv_values(
+                    thumbnail_keys[start:start + batch_size], 'image'
+                )
+            )
+    return live
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки, на которые не ссылается ни один пост, и '
+        'миниатюры sorl-thumbnail, которые не принадлежат картинкам '
+        'постов. Каталоги обходятся потоково, ссылки проверяются пачками, '
+        'удаление идёт пачками с паузой. После удаления полезно выполнить '
+        '«manage.py thumbnail cleanup».'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--pause', type=float, default=0.1,
+            help='Пауза после каждой пачки удалений, секунд'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: их пост '
+                 'может быть ещё не сохранён'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.deadline = time.time() - options['min_age']
+        self.found = self.removed = self.reclaimed = 0
+        upload_to = Post._meta.get_field('image').upload_to
+        self.collect(upload_to, self.unreferenced_images)
+        live = live_thumbnails(options['batch_size'])
+        self.collect(
+            thumbnail_settings.THUMBNAIL_PREFIX,
+            lambda names: [name for name in names if name not in live]
+        )
+        self.stdout.write(
+            f'orphans={self.found} removed={self.removed} '
+            f'reclaimed={self.reclaimed} bytes'
+            + (' (dry run)' if options['dry_run'] else '')
+        )
+
+    def unreferenced_images(self, names):
+        referenced = set(
+            Post.objects.filter(image__in=names).values_list(
+                'image', flat=True
+            )
+        )
+        return [name for name in names if name not in referenced]
+
+    def collect(self, directory, find_orphans):
+        root = settings.MEDIA_ROOT
+        entries = (
+            entry for entry in scan(os.path.join(root, directory))
+            if entry.stat(follow_symlinks=False).st_mtime < self.deadline
+        )
+        for batch in batched(entries, self.options['batch_size']):
+            by_name = {
+                os.path.relpath(entry.path, root).replace(os.sep, '/'): entry
+                for entry in batch
+            }
+            orphans = find_orphans(list(by_name))
+            self.found += len(orphans)
+            for name in orphans:
+                entry = by_name[name]
+                size = entry.stat(follow_symlinks=False).st_size
+                if not self.options['dry_run']:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    self.removed += 1
+                self.reclaimed += size
+            if orphans and not self.options['dry_run']:
+                time.sleep(self.options['pause'])
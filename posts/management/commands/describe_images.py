@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import describe
+from posts.models import ImageHash, Post
+
+FIELDS = ['image_width', 'image_height', 'image_placeholder']
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает размеры, превью и перцептивный хеш для картинок постов, '
+        'загруженных до появления этих полей. Новые загрузки описываются '
+        'при сохранении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).filter(image_placeholder='').only('id', 'image').order_by('pk')
+        last_id = 0
+        described = failed = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_id)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            updated = []
+            for post in batch:
+                try:
+                    with post.image.open('rb') as image:
+                        description = describe(image)
+                except OSError:
+                    description = None
+                if description is None:
+                    failed += 1
+                    continue
+                post.describe_image(description)
+                updated.append(post)
+            Post.objects.bulk_update(updated, FIELDS)
+            ImageHash.objects.bulk_create(
+                [
+                    ImageHash.build(post.pk, post._perceptual_hash)
+                    for post in updated
+                ],
+                ignore_conflicts=True
+            )
+            described += len(updated)
+        self.stdout.write(f'described={described} failed={failed}')
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from posts.duplicates import MAX_DISTANCE, duplicate_clusters
+from posts.images import hash_path, to_unsigned
+from posts.models import ImageHash, Post
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает перцептивные хеши картинок постов, у которых их ещё '
+        'нет, в пуле процессов и выводит группы постов с похожими '
+        'картинками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument(
+            '--max-distance', type=int, default=MAX_DISTANCE,
+            help='Наибольшее расстояние Хэмминга между хешами похожих '
+                 'картинок (для поиска по полосам - не больше 3)'
+        )
+
+    def hash_missing(self, workers):
+        unhashed = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).filter(image_hash__isnull=True).values_list('id', 'image')
+        storage = Post._meta.get_field('image').storage
+        posts_by_name = {}
+        for post_id, name in unhashed.iterator():
+            posts_by_name.setdefault(name, []).append(post_id)
+        names = list(posts_by_name)
+        hashed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            values = pool.map(
+                hash_path, [storage.path(name) for name in names],
+                chunksize=32
+            )
+            batch = []
+            for name, value in zip(names, values):
+                if value is None:
+                    continue
+                batch.extend(
+                    ImageHash.build(post_id, value)
+                    for post_id in posts_by_name[name]
+                )
+                if len(batch) >= BATCH_SIZE:
+                    ImageHash.objects.bulk_create(batch)
+                    hashed += len(batch)
+                    batch = []
+            ImageHash.objects.bulk_create(batch)
+            hashed += len(batch)
+        return hashed
+
+    def handle(self, *args, **options):
+        hashed = self.hash_missing(options['workers'])
+        hashes = {
+            post_id: to_unsigned(value)
+            for post_id, value in ImageHash.objects.values_list(
+                'post_id', 'value'
+            ).iterator()
+        }
+        clusters = duplicate_clusters(hashes, options['max_distance'])
+        for members in clusters:
+            self.stdout.write(
+                f'{len(members)}: ' + ' '.join(map(str, members))
+            )
+        self.stdout.write(
+            f'hashed={hashed} images={len(hashes)} clusters={len(clusters)}'
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from posts.duplicates import MAX_DISTANCE, duplicate_clusters
+from posts.images import to_unsigned
+from posts.models import Comment, Post, TextHash
+from posts.simhash import simhash
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает SimHash постов и комментариев, у которых его ещё нет, '
+        'и выводит группы почти одинаковых текстов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-distance', type=int, default=MAX_DISTANCE,
+            help='Наибольшее расстояние Хэмминга между отпечатками почти '
+                 'одинаковых текстов'
+        )
+
+    def hash_missing(self, kind, model):
+        unhashed = model.objects.exclude(
+            id__in=TextHash.objects.filter(kind=kind).values('object_id')
+        ).values_list('id', 'text')
+        hashed = 0
+        batch = []
+        for object_id, text in unhashed.iterator():
+            value = simhash(text)
+            if value is None:
+                continue
+            batch.append(TextHash.build(kind, object_id, value))
+            if len(batch) >= BATCH_SIZE:
+                TextHash.objects.bulk_create(batch)
+                hashed += len(batch)
+                batch = []
+        TextHash.objects.bulk_create(batch)
+        return hashed + len(batch)
+
+    def handle(self, *args, **options):
+        hashed = (
+            self.hash_missing(TextHash.POST, Post)
+            + self.hash_missing(TextHash.COMMENT, Comment)
+        )
+        hashes = {
+            (kind, object_id): to_unsigned(value)
+            for kind, object_id, value in TextHash.objects.values_list(
+                'kind', 'object_id', 'value'
+            ).iterator()
+        }
+        clusters = duplicate_clusters(hashes, options['max_distance'])
+        for members in clusters:
+            self.stdout.write(f'{len(members)}: ' + ' '.join(
+                f'{kind}:{object_id}' for kind, object_id in members
+            ))
+        self.stdout.write(
+            f'hashed={hashed} texts={len(hashes)} clusters={len(clusters)}'
+        )
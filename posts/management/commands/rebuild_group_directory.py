@@ -0,0 +1,16 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from posts import counters, directory
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает сохранённые агрегаты каталога сообществ: число '
+        'записей, последнюю активность и число подписчиков.'
+    )
+
+    def handle(self, *args, **options):
+        updated = directory.rebuild()
+        cache.delete(counters.ALL_GROUPS_KEY)
+        self.stdout.write(f'groups={updated}')
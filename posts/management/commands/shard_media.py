@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Post
+from posts.storage import is_sharded
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в раскладку по хешу содержимого и '
+        'пачками переписывает Post.image. Сайт при этом работает: новый '
+        'файл записывается до обновления строки, строка обновляется, '
+        'только если картинку не успели заменить, а старый файл '
+        'удаляется (--delete-old) после фиксации пачки и только если на '
+        'него больше никто не ссылается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Пауза между пачками, секунд'
+        )
+        parser.add_argument('--delete-old', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        posts = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).order_by('pk')
+        last_id = 0
+        moved = missing = deleted = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_id).values_list('pk', 'image')[
+                    :options['batch_size']
+                ]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            renamed = {}
+            for _, name in batch:
+                if is_sharded(name) or name in renamed:
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                with storage.open(name) as source:
+                    renamed[name] = storage.save(name, source)
+            with transaction.atomic():
+                for pk, name in batch:
+                    if name in renamed:
+                        moved += Post.objects.filter(
+                            pk=pk, image=name
+                        ).update(image=renamed[name])
+            if options['delete_old'] and renamed:
+                still_used = set(
+                    Post.objects.filter(image__in=renamed).values_list(
+                        'image', flat=True
+                    )
+                )
+                for name in set(renamed) - still_used:
+                    storage.delete(name)
+                    deleted += 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(
+            f'moved={moved} missing={missing} deleted={deleted}'
+        )
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.6 on 2026-10-19 05:36
+
+from django.conf import settings
+from django.db import migrations, models
+from django.template.defaultfilters import linebreaksbr
+from django.utils.text import Truncator
+
+BATCH_SIZE = 500
+
+
+def render_text(text):
+    return linebreaksbr(text, autoescape=True)
+
+
+def render_preview(text):
+    return render_text(Truncator(text).chars(settings.PREVIEW_LENGTH))
+
+
+def render_existing(apps, schema_editor):
+    for name in ('Post', 'Comment'):
+        model = apps.get_model('posts', name)
+        batch = []
+        for obj in model.objects.only('text').iterator():
+            obj.text_html = render_text(obj.text)
+            obj.preview_html = render_preview(obj.text)
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(
+                    batch, ['text_html', 'preview_html']
+                )
+                batch = []
+        model.objects.bulk_update(batch, ['text_html', 'preview_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_auto_20210129_1106'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='preview_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='text_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='preview_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
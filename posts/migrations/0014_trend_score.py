@@ -0,0 +1,77 @@
+# Generated by Django 2.2.6 on 2026-10-19 05:51
+
+import math
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 500
+DECAY = math.log(2) / settings.TREND_HALF_LIFE
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+POST_WEIGHT = 3
+COMMENT_WEIGHT = 1
+
+
+def log_weight(weight, moment):
+    return math.log(weight) + DECAY * (moment - EPOCH).total_seconds()
+
+
+def log_sum(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def score_existing(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Group = apps.get_model('posts', 'Group')
+    Comment = apps.get_model('posts', 'Comment')
+    post_events = {}
+    post_groups = {}
+    group_events = {}
+    posts = Post.objects.values_list('id', 'group_id', 'pub_date')
+    for post_id, group_id, pub_date in posts.iterator():
+        post_events[post_id] = [log_weight(POST_WEIGHT, pub_date)]
+        post_groups[post_id] = group_id
+    comments = Comment.objects.values_list('post_id', 'created')
+    for post_id, created in comments.iterator():
+        post_events[post_id].append(log_weight(COMMENT_WEIGHT, created))
+    for post_id, events in post_events.items():
+        if post_groups[post_id] is not None:
+            group_events.setdefault(post_groups[post_id], []).extend(events)
+    for model, events in ((Post, post_events), (Group, group_events)):
+        batch = [
+            model(pk=pk, trend_score=log_sum(values))
+            for pk, values in events.items()
+        ]
+        model.objects.bulk_update(batch, ['trend_score'], BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_follow_suggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='trend_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='trend_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['-trend_score'], name='posts_group_trend_s_9d8544_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-trend_score'], name='posts_post_trend_s_0b1782_idx'),
+        ),
+        migrations.RunPython(score_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.6 on 2026-10-19 05:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_directory(apps, schema_editor):
+    Group = apps.get_model('posts', 'Group')
+    posts = apps.get_model('posts', 'Post').objects.filter(
+        group=OuterRef('pk')
+    ).order_by()
+    subscribers = apps.get_model('posts', 'GroupFollow').objects.filter(
+        group=OuterRef('pk')
+    ).order_by()
+    Group.objects.update(
+        post_count=Coalesce(Subquery(
+            posts.values('group').annotate(total=Count('id')).values('total')
+        ), 0),
+        last_activity=Subquery(
+            posts.order_by('-pub_date').values('pub_date')[:1]
+        ),
+        subscriber_count=Coalesce(Subquery(
+            subscribers.values('group').annotate(
+                total=Count('id')
+            ).values('total')
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_trend_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='last_activity',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='post_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='subscriber_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['-last_activity'], name='posts_group_last_ac_ab6098_idx'),
+        ),
+        migrations.RunPython(fill_directory, migrations.RunPython.noop),
+    ]
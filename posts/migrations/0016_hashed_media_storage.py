@@ -0,0 +1,19 @@
+# Generated by Django 2.2.6 on 2026-10-19 05:56
+
+from django.db import migrations, models
+import posts.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_group_directory'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.HashedMediaStorage(), upload_to='posts/', verbose_name='Картинка'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.6 on 2026-10-19 05:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='image_hash', serialize=False, to='posts.Post')),
+                ('value', models.BigIntegerField()),
+                ('band_0', models.IntegerField(db_index=True)),
+                ('band_1', models.IntegerField(db_index=True)),
+                ('band_2', models.IntegerField(db_index=True)),
+                ('band_3', models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
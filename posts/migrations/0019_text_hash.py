@@ -0,0 +1,31 @@
+# Generated by Django 2.2.6 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_image_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextHash',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Пост'), ('comment', 'Комментарий')], max_length=7)),
+                ('object_id', models.PositiveIntegerField()),
+                ('value', models.BigIntegerField()),
+                ('band_0', models.IntegerField(db_index=True)),
+                ('band_1', models.IntegerField(db_index=True)),
+                ('band_2', models.IntegerField(db_index=True)),
+                ('band_3', models.IntegerField(db_index=True)),
+                ('duplicates', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='texthash',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_text_hashes'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.6 on 2026-10-19 06:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Значение FEED_CELEBRITY_FOLLOWERS на момент миграции
+CELEBRITY_FOLLOWERS = 10000
+BATCH_SIZE = 1000
+
+
+def mark_pushed(apps, schema_editor):
+    """Посты обычных авторов отмечаются разосланными и дописываются в
+    ленты подписчиков, которым не достались (посты, опубликованные,
+    пока автор был знаменитостью). Посты знаменитостей остаются
+    неразосланными и читаются через pull."""
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    celebrities = set(
+        Follow.objects.values('author').annotate(
+            total=Count('id')
+        ).filter(total__gte=CELEBRITY_FOLLOWERS).values_list(
+            'author', flat=True
+        )
+    )
+    Post.objects.exclude(author__in=celebrities).update(pushed=True)
+    followers = {}
+    for user_id, author_id in Follow.objects.values_list(
+        'user_id', 'author_id'
+    ).iterator():
+        if author_id not in celebrities:
+            followers.setdefault(author_id, []).append(user_id)
+    batch = []
+    for author_id, user_ids in followers.items():
+        posts = Post.objects.filter(author_id=author_id).values_list(
+            'id', 'pub_date'
+        )
+        for post_id, pub_date in posts.iterator():
+            for user_id in user_ids:
+                batch.append(TimelineEntry(
+                    user_id=user_id, post_id=post_id, pub_date=pub_date
+                ))
+                if len(batch) >= BATCH_SIZE:
+                    TimelineEntry.objects.bulk_create(
+                        batch, ignore_conflicts=True
+                    )
+                    batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_mention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='pushed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_pushed, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(pushed=False), fields=['author', '-pub_date'], name='post_unpushed_author_idx'),
+        ),
+    ]
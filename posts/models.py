@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .images import describe, hash_bands, to_signed
+from .storage import hashed_media_storage
+from .text import render_with_mentions
+
 User = get_user_model()
 
 
@@ -8,6 +12,18 @@ class Group(models.Model):
     title = models.CharField('Заголовок', max_length=200)
     slug = models.SlugField(max_length=50, unique=True)
     description = models.TextField('Описание',)
+    # см. trending.py
+    trend_score = models.FloatField(editable=False, default=0)
+    # см. directory.py
+    post_count = models.IntegerField(editable=False, default=0)
+    last_activity = models.DateTimeField(editable=False, null=True)
+    subscriber_count = models.IntegerField(editable=False, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-trend_score']),
+            models.Index(fields=['-last_activity']),
+        ]
 
     def __str__(self):
         return self.title
@@ -38,17 +54,57 @@ class Post(models.Model):
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=hashed_media_storage,
         blank=True,
         null=True,
         verbose_name='Картинка',
     )
+    # см. images.py
+    image_width = models.PositiveIntegerField(editable=False, null=True)
+    image_height = models.PositiveIntegerField(editable=False, null=True)
+    image_placeholder = models.TextField(editable=False, default='')
+    text_html = models.TextField(editable=False, default='')
+    preview_html = models.TextField(editable=False, default='')
+    trend_score = models.FloatField(editable=False, default=0)
+    # разослан ли пост по лентам подписчиков (см. timeline.py)
+    pushed = models.BooleanField(editable=False, default=False)
 
     class Meta:
         ordering = ("-pub_date",)
+        indexes = [
+            models.Index(fields=['author', '-pub_date']),
+            models.Index(fields=['group', '-pub_date']),
+            models.Index(fields=['-trend_score']),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='post_unpushed_author_idx',
+                condition=models.Q(pushed=False),
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        self.text_html, self.preview_html, self.mentioned_ids = (
+            render_with_mentions(self.text)
+        )
+        image_changed = False
+        if not self.image:
+            image_changed = self.image_width is not None
+            self.describe_image(None)
+        elif not self.image._committed:
+            # новая загрузка: файл ещё в памяти или во временном файле
+            image_changed = True
+            self.describe_image(describe(self.image))
+        super().save(*args, **kwargs)
+        if image_changed:
+            ImageHash.store(self.pk, self._perceptual_hash)
+
+    def describe_image(self, description):
+        (self.image_width, self.image_height, self.image_placeholder,
+         self._perceptual_hash) = description or (None, None, '', None)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -71,15 +127,66 @@ class Comment(models.Model):
         help_text='Введите ваш комментарий*',
     )
     created = models.DateTimeField(auto_now_add=True)
+    text_html = models.TextField(editable=False, default='')
+    preview_html = models.TextField(editable=False, default='')
 
     class Meta:
         ordering = ('-created',)
+        indexes = [models.Index(fields=['post', '-created'])]
         verbose_name = 'Comment'
         verbose_name_plural = 'Comments'
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        self.text_html, self.preview_html, self.mentioned_ids = (
+            render_with_mentions(self.text, tags=False)
+        )
+        super().save(*args, **kwargs)
+
+
+class Mention(models.Model):
+    """Уведомление об @упоминании в посте или комментарии. Пишется
+    пачками в фоне (см. notifications.py)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='mentions'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    comment = models.ForeignKey(
+        Comment,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-created'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                condition=models.Q(comment__isnull=True),
+                name='unique_post_mentions'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'comment'],
+                condition=models.Q(comment__isnull=False),
+                name='unique_comment_mentions'
+            ),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -100,3 +207,183 @@ class Follow(models.Model):
                 name='unique_follows'
             )
         ]
+
+
+class GroupFollow(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='group_follows'
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='followers'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'group'],
+                name='unique_group_follows'
+            )
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Пост, разосланный в ленту подписчика при публикации."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-pub_date', '-post'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entries'
+            )
+        ]
+
+
+class FollowSuggestion(models.Model):
+    """Автор, рекомендованный пользователю ночным расчётом."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='follow_suggestions'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', '-score'])]
+
+
+class Tag(models.Model):
+    """Нормализованный #тег из текстов постов (см. tags.py)."""
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class PostTag(models.Model):
+    """Инвертированный индекс тегов: дата поста продублирована, чтобы
+    лента тега читалась диапазоном индекса (tag, -pub_date, -post)."""
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='post_tags'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='post_tags'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tag', 'post'],
+                name='unique_post_tags'
+            )
+        ]
+        indexes = [models.Index(fields=['tag', '-pub_date', '-post'])]
+
+
+class RelatedPost(models.Model):
+    """Похожий по тексту пост из ночного расчёта (см. related.py)."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='related_posts'
+    )
+    related = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['post', '-score'])]
+
+
+class ImageHash(models.Model):
+    """Перцептивный хеш картинки поста с полосами для поиска похожих
+    (см. duplicates.py)."""
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='image_hash'
+    )
+    value = models.BigIntegerField()
+    band_0 = models.IntegerField(db_index=True)
+    band_1 = models.IntegerField(db_index=True)
+    band_2 = models.IntegerField(db_index=True)
+    band_3 = models.IntegerField(db_index=True)
+
+    @classmethod
+    def build(cls, post_id, value):
+        bands = {
+            f'band_{band}': part for band, part in enumerate(hash_bands(value))
+        }
+        return cls(post_id=post_id, value=to_signed(value), **bands)
+
+    @classmethod
+    def store(cls, post_id, value):
+        if value is None:
+            cls.objects.filter(post_id=post_id).delete()
+        else:
+            cls.build(post_id, value).save()
+
+
+class TextHash(models.Model):
+    """SimHash текста поста или комментария с полосами для поиска
+    почти одинаковых текстов (см. simhash.py)."""
+    POST = 'post'
+    COMMENT = 'comment'
+    KINDS = ((POST, 'Пост'), (COMMENT, 'Комментарий'))
+
+    kind = models.CharField(max_length=7, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    value = models.BigIntegerField()
+    band_0 = models.IntegerField(db_index=True)
+    band_1 = models.IntegerField(db_index=True)
+    band_2 = models.IntegerField(db_index=True)
+    band_3 = models.IntegerField(db_index=True)
+    # сколько почти таких же текстов уже было в момент записи
+    duplicates = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'object_id'],
+                name='unique_text_hashes'
+            )
+        ]
+
+    @classmethod
+    def build(cls, kind, object_id, value, duplicates=0):
+        bands = {
+            f'band_{band}': part for band, part in enumerate(hash_bands(value))
+        }
+        return cls(
+            kind=kind, object_id=object_id, value=to_signed(value),
+            duplicates=duplicates, **bands
+        )
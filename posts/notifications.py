@@ -0,0 +1,118 @@
+"""Уведомления об @упоминаниях.
+
+Запрос только кладёт готовые строки Mention в очередь процесса после
+фиксации транзакции. Фоновый поток раз в MENTION_NOTIFY_INTERVAL секунд
+забирает накопленное и пишет его пачками по BATCH_SIZE одним
+bulk_create; повторы (правка поста с теми же упоминаниями) отсекаются
+уникальными ограничениями Mention, а строки об удалённых за это время
+постах, комментариях и пользователях пропускаются. Ошибка записи пачки
+попадает в лог и не останавливает поток. Перед выходом процесса очередь
+дописывается; при аварийном завершении последние уведомления теряются.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Comment, Mention, Post, User
+
+INTERVAL = settings.MENTION_NOTIFY_INTERVAL
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class MentionNotifier:
+
+    def __init__(self, interval=INTERVAL, batch_size=BATCH_SIZE,
+                 autostart=True):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.autostart = autostart
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def notify(self, mentions):
+        for mention in mentions:
+            self.pending.put(mention)
+        if self.autostart and self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self.run, name='mention-notifier', daemon=True
+                    )
+                    self.thread.start()
+                    atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Записывает всё накопленное пачками, возвращает число строк."""
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return written
+            try:
+                written += self.write(batch)
+            except Exception:
+                # пачка теряется, но следующие запишутся
+                logger.exception(
+                    'Failed to write %d mention notifications', len(batch)
+                )
+
+    def write(self, batch):
+        """Пишет пачку без уведомлений об удалённых постах, комментариях
+        и пользователях: иначе одна такая строка нарушила бы внешний ключ
+        и сорвала всю пачку."""
+        post_ids = set(Post.objects.filter(
+            pk__in={mention.post_id for mention in batch}
+        ).values_list('pk', flat=True))
+        comment_ids = set(Comment.objects.filter(
+            pk__in={mention.comment_id for mention in batch} - {None}
+        ).values_list('pk', flat=True))
+        user_ids = set(User.objects.filter(
+            pk__in={mention.user_id for mention in batch}
+            | {mention.author_id for mention in batch}
+        ).values_list('pk', flat=True))
+        alive = [
+            mention for mention in batch
+            if mention.post_id in post_ids
+            and (mention.comment_id is None
+                 or mention.comment_id in comment_ids)
+            and {mention.user_id, mention.author_id} <= user_ids
+        ]
+        Mention.objects.bulk_create(alive, ignore_conflicts=True)
+        return len(alive)
+
+
+notifier = MentionNotifier()
+
+
+def notify_mentions(author_id, user_ids, post_id, comment_id=None):
+    """Ставит уведомления упомянутым пользователям, кроме автора."""
+    mentions = [
+        Mention(
+            user_id=user_id, author_id=author_id,
+            post_id=post_id, comment_id=comment_id
+        )
+        for user_id in user_ids if user_id != author_id
+    ]
+    if mentions:
+        transaction.on_commit(lambda: notifier.notify(mentions))
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+
+PER_PAGE = settings.PER_PAGE
+
+
+def paginate(request, object_list, count):
+    paginator = Paginator(object_list, PER_PAGE)
+    # Paginator.count - cached_property, подставляем готовый счётчик
+    # вместо SELECT COUNT(*) на каждый просмотр
+    paginator.count = count
+    page = paginator.get_page(request.GET.get('page'))
+    return paginator, page
@@ -0,0 +1,47 @@
+"""Замена таблиц, которые целиком пересчитываются ночными командами.
+
+Строки приходят из генератора по возрастанию id источника (поста или
+пользователя) и пишутся пачками по BATCH_SIZE: каждая пачка в своей
+короткой транзакции удаляет старые строки источников из своего
+диапазона id и вставляет новые. В памяти одновременно только одна
+пачка, блокировка записи в SQLite не держится на время расчёта, а
+читатель для каждого источника видит либо прежний, либо новый набор.
+"""
+from django.db import transaction
+
+BATCH_SIZE = 1000
+
+
+def replace_rows(model, key, rows, batch_size=BATCH_SIZE):
+    """Заменяет все строки ``model`` несохранёнными объектами ``rows``,
+    упорядоченными по полю ``key``. Возвращает число записанных строк.
+
+    Пачка режется только между источниками, так что строки одного
+    источника меняются вместе; источники без новых строк очищаются
+    диапазонным DELETE своей пачки."""
+    key = model._meta.get_field(key).attname
+    lower = None
+    written = 0
+    batch = []
+
+    def swap(upper):
+        bounds = {}
+        if lower is not None:
+            bounds[f'{key}__gt'] = lower
+        if upper is not None:
+            bounds[f'{key}__lte'] = upper
+        with transaction.atomic():
+            model.objects.filter(**bounds).delete()
+            model.objects.bulk_create(batch)
+        return upper
+
+    for row in rows:
+        if len(batch) >= batch_size and (
+            getattr(row, key) != getattr(batch[-1], key)
+        ):
+            lower = swap(getattr(batch[-1], key))
+            written += len(batch)
+            batch = []
+        batch.append(row)
+    swap(None)
+    return written + len(batch)
@@ -0,0 +1,105 @@
+"""Ночной расчёт похожих постов по TF-IDF.
+
+Слова текста хешируются в N_FEATURES столбцов (zlib.crc32), поэтому
+словарь в памяти не строится и держится только разреженная матрица
+X: строка - пост, столбец - хеш слова. Веса - сублинейная частота
+1 + ln(tf), умноженная на сглаженный idf; слова из одного поста и
+слишком частые слова отбрасываются, строки нормируются по L2, так что
+косинусная близость - это X @ X.T.
+
+Произведение считается блоками строк: в памяти одновременно матрица X
+и оценки одного блока, лучшие соседи каждой строки сохраняются в
+RelatedPost, так что при показе поста остаётся одно чтение по индексу.
+"""
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from .models import Post, RelatedPost
+from .simhash import WORD
+from .suggestions import top_candidates
+
+N_FEATURES = 2 ** 20
+# Частые слова почти не различают посты, а блоки оценок делают плотными
+MAX_DF = 0.1
+MIN_SCORE = 0.1
+BLOCK_SIZE = 500
+
+
+def term_counts(text):
+    """Столбцы слов текста и сколько раз каждое встретилось."""
+    words = WORD.findall(text.lower())
+    hashes = np.fromiter(
+        (zlib.crc32(word.encode()) for word in words),
+        dtype=np.int64, count=len(words)
+    ) % N_FEATURES
+    return np.unique(hashes, return_counts=True)
+
+
+def tfidf_matrix(max_df=MAX_DF):
+    """Id постов и нормированная матрица TF-IDF в их порядке."""
+    ids, indices, counts, indptr = [], [], [], [0]
+    texts = Post.objects.order_by('id').values_list('id', 'text')
+    for post_id, text in texts.iterator():
+        columns, column_counts = term_counts(text)
+        ids.append(post_id)
+        indices.append(columns.astype(np.int32))
+        counts.append(column_counts.astype(np.float32))
+        indptr.append(indptr[-1] + len(columns))
+    matrix = sparse.csr_matrix(
+        (
+            np.concatenate(counts or [np.empty(0, np.float32)]),
+            np.concatenate(indices or [np.empty(0, np.int32)]),
+            np.array(indptr, dtype=np.int64),
+        ),
+        shape=(len(ids), N_FEATURES)
+    )
+    documents = np.bincount(matrix.indices, minlength=N_FEATURES)
+    total = len(ids)
+    idf = np.log((1 + total) / (1 + documents)) + 1
+    idf[(documents < 2) | (documents > max_df * total)] = 0
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return np.array(ids), (sparse.diags(1 / norms) @ matrix).astype(
+        np.float32
+    ).tocsr()
+
+
+def score_block(matrix, matrix_t, start, stop, min_score=MIN_SCORE):
+    """Косинусная близость строк [start, stop) ко всем постам."""
+    own = sparse.eye(stop - start, matrix.shape[0], k=start, format='csr')
+    scores = (matrix[start:stop] @ matrix_t).tocsr()
+    scores = (scores - scores.multiply(own)).tocsr()
+    scores.data[scores.data < min_score] = 0
+    scores.eliminate_zeros()
+    return scores
+
+
+def compute_related(limit, block_size=BLOCK_SIZE, max_df=MAX_DF,
+                    min_score=MIN_SCORE):
+    """Генерирует несохранённые RelatedPost по всем постам."""
+    ids, matrix = tfidf_matrix(max_df)
+    matrix_t = matrix.T.tocsr()
+    for start in range(0, len(ids), block_size):
+        stop = min(start + block_size, len(ids))
+        scores = score_block(matrix, matrix_t, start, stop, min_score)
+        for row, columns, data in top_candidates(scores, limit):
+            post_id = int(ids[start + row])
+            for column, score in zip(columns, data):
+                yield RelatedPost(
+                    post_id=post_id,
+                    related_id=int(ids[column]),
+                    score=float(score),
+                )
+
+
+def related_posts(post, limit):
+    """Похожие посты одним чтением по индексу (post, -score)."""
+    return [
+        related.related for related in RelatedPost.objects.filter(
+            post=post
+        ).select_related('related__author').order_by('-score')[:limit]
+    ]
@@ -0,0 +1,140 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import (counters, directory, notifications, simhash, tags, timeline,
+               trending)
+from .models import Comment, Group, GroupFollow, Post, TextHash
+
+
+def post_count_keys(author_id, group_id):
+    keys = [counters.ALL_POSTS_KEY, counters.author_key(author_id)]
+    if group_id is not None:
+        keys.append(counters.group_key(group_id))
+    return keys
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._saved_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Post)
+def score_new_post(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance.trend_score = trending.log_weight(
+            trending.POST_WEIGHT, timezone.now()
+        )
+
+
+@receiver(pre_save, sender=Post)
+def choose_delivery(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance.pushed = not timeline.is_celebrity(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change(
+            post_count_keys(instance.author_id, instance.group_id), 1
+        )
+        counters.raise_watermarks(instance)
+        timeline.push_post(instance)
+        trending.record_post(instance)
+        if instance.group_id is not None:
+            directory.add_post(instance)
+        return
+    saved_group_id = getattr(instance, '_saved_group_id', None)
+    if saved_group_id != instance.group_id:
+        if saved_group_id is not None:
+            counters.change([counters.group_key(saved_group_id)], -1)
+        if instance.group_id is not None:
+            counters.change([counters.group_key(instance.group_id)], 1)
+        directory.move_post(instance, saved_group_id)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change(
+        post_count_keys(instance.author_id, instance.group_id), -1
+    )
+    if instance.group_id is not None:
+        directory.remove_post(instance.group_id)
+
+
+@receiver(post_save, sender=Group)
+def count_saved_group(sender, instance, created, **kwargs):
+    if created:
+        counters.change([counters.ALL_GROUPS_KEY], 1)
+
+
+@receiver(post_delete, sender=Group)
+def count_deleted_group(sender, instance, **kwargs):
+    counters.change([counters.ALL_GROUPS_KEY], -1)
+
+
+@receiver(post_save, sender=GroupFollow)
+def count_group_follow(sender, instance, created, **kwargs):
+    if created:
+        directory.change_subscribers(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=GroupFollow)
+def count_group_unfollow(sender, instance, **kwargs):
+    # срабатывает и при каскадном удалении пользователя
+    directory.change_subscribers(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change([counters.comment_key(instance.post_id)], 1)
+        trending.record_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change([counters.comment_key(instance.post_id)], -1)
+
+
+@receiver(post_save, sender=Post)
+def store_post_tags(sender, instance, created, **kwargs):
+    tags.store_tags(instance, created)
+
+
+@receiver(post_save, sender=Post)
+def notify_post_mentions(sender, instance, **kwargs):
+    notifications.notify_mentions(
+        instance.author_id, getattr(instance, 'mentioned_ids', ()),
+        instance.pk
+    )
+
+
+@receiver(post_save, sender=Comment)
+def notify_comment_mentions(sender, instance, created, **kwargs):
+    if created:
+        notifications.notify_mentions(
+            instance.author_id, getattr(instance, 'mentioned_ids', ()),
+            instance.post_id, instance.pk
+        )
+
+
+@receiver(post_save, sender=Post)
+def fingerprint_post(sender, instance, **kwargs):
+    simhash.fingerprint(TextHash.POST, instance.pk, instance.text)
+
+
+@receiver(post_save, sender=Comment)
+def fingerprint_comment(sender, instance, **kwargs):
+    simhash.fingerprint(TextHash.COMMENT, instance.pk, instance.text)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def forget_fingerprint(sender, instance, **kwargs):
+    kind = TextHash.POST if sender is Post else TextHash.COMMENT
+    TextHash.objects.filter(kind=kind, object_id=instance.pk).delete()
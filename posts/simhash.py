@@ -0,0 +1,74 @@
+"""Поиск почти одинаковых текстов постов и комментариев.
+
+SimHash: каждое слово текста хешируется в 64 бита, и i-й бит отпечатка -
+знак суммы по словам (+1, если i-й бит хеша слова установлен, иначе -1).
+У текстов, отличающихся парой слов, отпечатки расходятся в нескольких
+битах. Шинглы из нескольких слов для постов такой длины хуже: замена
+одного слова меняет сразу несколько признаков.
+
+Отпечатки хранятся в TextHash с теми же четырьмя 16-битными полосами,
+что и хеши картинок (duplicates.py): при записи кандидаты ищутся по
+индексам полос, так что проверка не зависит от размера корпуса.
+"""
+import hashlib
+import re
+
+from django.db.models import Q
+
+from .duplicates import MAX_DISTANCE, hamming
+from .images import hash_bands, to_unsigned
+from .models import TextHash
+
+# Короткие реплики («спасибо!», «+1») совпадают и без всякого спама
+MIN_WORDS = 8
+# Сколько строк с общей полосой читать при записи: для модерации важно,
+# что повторов много, а не их точное число
+MAX_CANDIDATES = 1000
+WORD = re.compile(r'\w+')
+
+
+def simhash(text):
+    """64-битный отпечаток текста или None для слишком короткого."""
+    words = WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    weights = [0] * 64
+    for word in words:
+        digest = int.from_bytes(
+            hashlib.blake2b(word.encode(), digest_size=8).digest(), 'big'
+        )
+        for bit in range(64):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def similar_texts(value, max_distance=MAX_DISTANCE, exclude=None,
+                  limit=None):
+    """Пары (kind, object_id) текстов с отпечатком, близким к
+    ``value``, среди первых ``limit`` кандидатов."""
+    query = Q()
+    for band, part in enumerate(hash_bands(value)):
+        query |= Q(**{f'band_{band}': part})
+    candidates = TextHash.objects.filter(query)
+    if exclude is not None:
+        kind, object_id = exclude
+        candidates = candidates.exclude(kind=kind, object_id=object_id)
+    rows = candidates.values_list('kind', 'object_id', 'value')[:limit]
+    return [
+        (kind, object_id)
+        for kind, object_id, other in rows
+        if hamming(value, to_unsigned(other)) <= max_distance
+    ]
+
+
+def fingerprint(kind, object_id, text):
+    """Сохраняет отпечаток текста и отмечает, сколько почти таких же
+    текстов уже есть (не больше MAX_CANDIDATES). Возвращает это
+    число."""
+    TextHash.objects.filter(kind=kind, object_id=object_id).delete()
+    value = simhash(text)
+    if value is None:
+        return 0
+    duplicates = len(similar_texts(value, limit=MAX_CANDIDATES))
+    TextHash.build(kind, object_id, value, duplicates).save()
+    return duplicates
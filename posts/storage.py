@@ -0,0 +1,60 @@
+"""Хранилище картинок постов с раскладкой по хешу содержимого.
+
+Файл сохраняется как posts/ab/cd/<sha256>.<ext>: два уровня по 256
+каталогов держат каталоги небольшими при миллионах файлов, а одинаковые
+загрузки попадают в один и тот же файл и не дублируются. Поэтому файл
+может принадлежать нескольким постам - удалять его можно только когда
+на него не ссылается ни один пост.
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+SHARDED = re.compile(r'^(.+/)?[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def sharded_name(name, digest):
+    """posts/photo.JPG -> posts/ab/cd/abcd....jpg"""
+    directory = posixpath.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return posixpath.join(
+        directory, digest[:2], digest[2:4], digest + extension
+    )
+
+
+def is_sharded(name):
+    return bool(SHARDED.match(name))
+
+
+@deconstructible
+class HashedMediaStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = sharded_name(name, content_hash(content))
+        if self.exists(name):
+            # такой файл уже загружен
+            return name
+        return self._save(name, content)
+
+
+hashed_media_storage = HashedMediaStorage()
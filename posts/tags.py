@@ -0,0 +1,88 @@
+"""Теги постов: разбор при сохранении и ленты тегов.
+
+Теги из текста (text.extract_tags) хранятся в Tag, а связи с постами -
+в PostTag с копией даты поста. Лента тега - диапазон индекса
+(tag, -pub_date, -post) с JOIN постов по первичному ключу, без LIKE по
+текстам. Страницы листаются курсором «раньше этого поста», поэтому
+глубокие страницы стоят столько же, сколько первая.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .feeds import load_feed_rows
+from .models import Post, PostTag, Tag
+from .text import extract_tags
+
+PER_PAGE = settings.PER_PAGE
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def tag_ids(names):
+    """Id тегов по именам; недостающие теги создаются."""
+    if not names:
+        return {}
+    ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in missing], ignore_conflicts=True
+        )
+        ids.update(
+            Tag.objects.filter(name__in=missing).values_list('name', 'id')
+        )
+    return ids
+
+
+def store_tags(post, created=False):
+    """Приводит PostTag поста в соответствие с его текстом."""
+    names = extract_tags(post.text)
+    current = {} if created else dict(
+        PostTag.objects.filter(post=post).values_list('tag__name', 'id')
+    )
+    stale = [link_id for name, link_id in current.items() if name not in names]
+    if stale:
+        PostTag.objects.filter(id__in=stale).delete()
+    ids = tag_ids([name for name in names if name not in current])
+    PostTag.objects.bulk_create([
+        PostTag(tag_id=tag_id, post_id=post.pk, pub_date=post.pub_date)
+        for tag_id in ids.values()
+    ], ignore_conflicts=True)
+
+
+def encode_cursor(post):
+    return f'{(post.pub_date - EPOCH) // MICROSECOND}-{post.id}'
+
+
+def decode_cursor(value):
+    """(pub_date, post_id) из курсора или None, если он испорчен."""
+    microseconds, _, post_id = (value or '').partition('-')
+    if not (microseconds.isdigit() and post_id.isdigit()):
+        return None
+    return EPOCH + int(microseconds) * MICROSECOND, int(post_id)
+
+
+def tag_feed(tag, before=None, limit=PER_PAGE):
+    """Посты тега новее-сначала и курсор следующей страницы (или None).
+
+    Условие на курсор и порядок заданы по колонкам PostTag, чтобы база
+    шла по индексу (tag, -pub_date, -post)."""
+    condition = Q(post_tags__tag=tag)
+    if before is not None:
+        pub_date, post_id = before
+        # pub_date <= ... отдельным условием - граница диапазона индекса
+        condition &= Q(post_tags__pub_date__lte=pub_date) & (
+            Q(post_tags__pub_date__lt=pub_date)
+            | Q(post_tags__post_id__lt=post_id)
+        )
+    posts = Post.objects.filter(condition).order_by(
+        F('post_tags__pub_date').desc(), F('post_tags__post_id').desc()
+    )
+    rows = load_feed_rows(posts[:limit + 1], with_comments=True)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
@@ -0,0 +1,28 @@
+from django import template
+
+register = template.Library()
+
+ON_EACH_SIDE = 2
+ON_ENDS = 1
+
+
+@register.simple_tag
+def page_window(page, on_each_side=ON_EACH_SIDE, on_ends=ON_ENDS):
+    """Номера страниц вокруг текущей; None на месте пропуска."""
+    number = page.number
+    num_pages = page.paginator.num_pages
+    if num_pages <= (on_each_side + on_ends) * 2 + 1:
+        return list(range(1, num_pages + 1))
+
+    window = []
+    if number > 1 + on_each_side + on_ends + 1:
+        window += list(range(1, on_ends + 1)) + [None]
+        start = number - on_each_side
+    else:
+        start = 1
+    if number < num_pages - on_each_side - on_ends - 1:
+        window += list(range(start, number + on_each_side + 1)) + [None]
+        window += list(range(num_pages - on_ends + 1, num_pages + 1))
+    else:
+        window += list(range(start, num_pages + 1))
+    return window
@@ -1,7 +1,25 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import default as thumbnail_default
+from sorl.thumbnail.images import ImageFile
 
-from posts.models import Group, Post
+from posts import duplicates, simhash
+from posts.images import to_unsigned
+from posts.models import Comment, Group, ImageHash, Post, TextHash
+from posts.storage import is_sharded
+from posts.text import extract_tags
 
 
 class PostModelTest(TestCase):
@@ -65,3 +83,354 @@ class PostModelTest(TestCase):
         group = PostModelTest.group
         group = self.group.title
         self.assertEqual(group.__str__(), group)
+
+    def test_text_html_rendered_on_save(self):
+        '''При сохранении текст экранируется и переводы строк заменяются'''
+        post = Post.objects.create(
+            text='<b>первая</b>\nвторая',
+            author=self.user,
+        )
+        self.assertEqual(
+            post.text_html, '&lt;b&gt;первая&lt;/b&gt;<br>вторая'
+        )
+        self.assertEqual(post.preview_html, post.text_html)
+
+    def test_tags_linked_in_text_html(self):
+        '''Теги в тексте становятся ссылками на страницы тегов'''
+        post = Post.objects.create(
+            text='Про #Django & #1, a&#b и <#tag>',
+            author=self.user,
+        )
+        self.assertEqual(
+            post.text_html,
+            'Про <a href="/tag/django/">#Django</a> &amp; #1, a&amp;#b и '
+            '&lt;<a href="/tag/tag/">#tag</a>&gt;'
+        )
+        self.assertEqual(extract_tags(post.text), ['django', 'tag'])
+
+    def test_preview_html_truncated(self):
+        '''Превью обрезается до PREVIEW_LENGTH символов'''
+        post = Post.objects.create(
+            text='а' * (settings.PREVIEW_LENGTH + 50),
+            author=self.user,
+        )
+        self.assertEqual(len(post.preview_html), settings.PREVIEW_LENGTH)
+        self.assertTrue(post.preview_html.endswith('…'))
+
+
+class ShardedImageTest(TestCase):
+    """Картинки раскладываются по хешу содержимого"""
+
+    GIF = (b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x3B')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+        self.user = get_user_model().objects.create(username='uploader')
+
+    def create_post(self, name):
+        return Post.objects.create(
+            text='Пост', author=self.user,
+            image=SimpleUploadedFile(name, self.GIF, 'image/gif')
+        )
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_post('one.GIF')
+        second = self.create_post('two.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_sharded(first.image.name))
+        self.assertTrue(first.image.name.endswith('.gif'))
+        directory = os.path.dirname(first.image.path)
+        self.assertEqual(os.listdir(directory), [
+            os.path.basename(first.image.name)
+        ])
+
+    def test_shard_media_command(self):
+        os.makedirs(os.path.join(self.media_root, 'posts'))
+        posts = []
+        for name in ('old1.gif', 'old2.gif'):
+            with open(os.path.join(self.media_root, 'posts', name),
+                      'wb') as f:
+                f.write(self.GIF)
+            post = Post.objects.create(text='Пост', author=self.user)
+            Post.objects.filter(pk=post.pk).update(image=f'posts/{name}')
+            posts.append(post)
+        call_command(
+            'shard_media', '--delete-old', '--batch-size=1',
+            stdout=StringIO()
+        )
+        names = {post.image.name for post in Post.objects.all()}
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_sharded(name))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.media_root, 'posts', 'old1.gif'))
+        )
+
+
+class MediaGarbageTest(TestCase):
+    """Сборщик удаляет только файлы без ссылок"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+        user = get_user_model().objects.create(username='gc')
+        self.post = Post.objects.create(
+            text='Пост', author=user,
+            image=SimpleUploadedFile('live.gif', b'live', 'image/gif')
+        )
+        self.orphan = self.write('posts/00/00/orphan.gif', b'orphan')
+        self.live_thumb = self.write('cache/aa/bb/live.jpg', b'thumb')
+        self.dead_thumb = self.write('cache/cc/dd/dead.jpg', b'dead!!')
+        thumbnail = ImageFile('cache/aa/bb/live.jpg', default_storage)
+        source = ImageFile(self.post.image.name, self.post.image.storage)
+        for image in (thumbnail, source):
+            image.set_size((1, 1))
+        thumbnail_default.kvstore.set(source)
+        thumbnail_default.kvstore.set(thumbnail, source)
+
+    def write(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command(
+            'collect_media_garbage', '--min-age=0', '--pause=0', *args,
+            stdout=out
+        )
+        return out.getvalue()
+
+    def test_dry_run_keeps_files(self):
+        output = self.collect('--dry-run')
+        self.assertIn('orphans=2 removed=0 reclaimed=12 bytes', output)
+        self.assertTrue(os.path.exists(self.orphan))
+
+    def test_removes_orphans_only(self):
+        output = self.collect()
+        self.assertIn('orphans=2 removed=2 reclaimed=12 bytes', output)
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertFalse(os.path.exists(self.dead_thumb))
+        self.assertTrue(os.path.exists(self.live_thumb))
+        self.assertTrue(os.path.exists(self.post.image.path))
+
+    def test_feed_thumbnails_kept(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(buffer, 'JPEG')
+        Post.objects.create(
+            text='В ленте', author=self.post.author,
+            image=SimpleUploadedFile(
+                'feed.jpg', buffer.getvalue(), 'image/jpeg'
+            )
+        )
+        Client().get(reverse('index'))
+        thumbnails = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(
+                os.path.join(self.media_root, 'cache')
+            )
+            for name in names
+        ]
+        self.assertEqual(len(thumbnails), 3)
+        self.collect()
+        for path in thumbnails:
+            if path != self.dead_thumb:
+                self.assertTrue(os.path.exists(path))
+
+
+class ImagePlaceholderTest(TestCase):
+    """Размеры и превью картинки считаются при загрузке"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = get_user_model().objects.create(username='painter')
+
+    def upload(self, size=(640, 480)):
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG')
+        return SimpleUploadedFile(
+            'photo.jpg', buffer.getvalue(), 'image/jpeg'
+        )
+
+    def test_described_on_upload(self):
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=self.upload()
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (640, 480))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/png;base64,')
+        )
+        self.assertLess(len(post.image_placeholder), 600)
+        post.image = None
+        post.save()
+        self.assertEqual(post.image_placeholder, '')
+
+    def test_backfill_command(self):
+        post = Post.objects.create(
+            text='Пост', author=self.user, image=self.upload((90, 30))
+        )
+        Post.objects.update(
+            image_width=None, image_height=None, image_placeholder=''
+        )
+        call_command('describe_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (90, 30))
+        self.assertNotEqual(post.image_placeholder, '')
+
+
+class DuplicateImageTest(TestCase):
+    """Похожие картинки находятся по полосам перцептивного хеша"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = get_user_model().objects.create(username='reposter')
+
+    def upload(self, size, quality=90, flip=False):
+        image = Image.new('RGB', (64, 64), 'white')
+        for x in range(32):
+            for y in range(64):
+                image.putpixel((x, y), (x * 8, y * 4, 0))
+        if flip:
+            image = image.transpose(Image.FLIP_LEFT_RIGHT)
+        buffer = BytesIO()
+        image.resize(size).save(buffer, 'JPEG', quality=quality)
+        return Post.objects.create(
+            text='Пост', author=self.user,
+            image=SimpleUploadedFile('a.jpg', buffer.getvalue(), 'image/jpeg')
+        )
+
+    def test_similar_images(self):
+        original = self.upload((640, 640))
+        resized = self.upload((300, 300), quality=40)
+        other = self.upload((640, 640), flip=True)
+        value = to_unsigned(original.image_hash.value)
+        self.assertEqual(
+            duplicates.similar_images(value, exclude_post=original.pk),
+            [resized.pk]
+        )
+        self.assertNotIn(
+            other.pk, duplicates.similar_images(value)
+        )
+        original.image = None
+        original.save()
+        self.assertFalse(ImageHash.objects.filter(post=original).exists())
+
+    def test_clusters_command(self):
+        first = self.upload((640, 640))
+        second = self.upload((320, 320), quality=50)
+        self.upload((640, 640), flip=True)
+        ImageHash.objects.all().delete()
+        out = StringIO()
+        call_command('find_duplicate_images', '--workers=2', stdout=out)
+        self.assertIn(f'2: {first.pk} {second.pk}', out.getvalue())
+        self.assertIn('hashed=3 images=3 clusters=1', out.getvalue())
+
+
+class DuplicateTextTest(TestCase):
+    """Почти одинаковые тексты отмечаются при записи"""
+    TEXT = (
+        'Продаю гараж в центре города недорого, звоните в любое время '
+        'по телефону, торг уместен, документы в порядке. Гараж '
+        'кирпичный, с подвалом и смотровой ямой, есть электричество и '
+        'хорошая охрана круглые сутки. Рядом остановка автобуса и магазин, '
+        'подъезд удобный в любую погоду, зимой дорогу чистят.'
+    )
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='spammer')
+
+    def test_near_copy_flagged(self):
+        original = Post.objects.create(text=self.TEXT, author=self.user)
+        copy = Post.objects.create(
+            text=self.TEXT.replace('недорого', 'дёшево'), author=self.user
+        )
+        comment = Comment.objects.create(
+            post=original, author=self.user, text=self.TEXT + '!'
+        )
+        other = Post.objects.create(
+            text='Сегодня ходили в поход на озеро, погода была отличная и '
+                 'все вернулись довольные',
+            author=self.user
+        )
+        flags = dict(TextHash.objects.filter(kind=TextHash.POST).values_list(
+            'object_id', 'duplicates'
+        ))
+        self.assertEqual(flags[original.pk], 0)
+        self.assertEqual(flags[copy.pk], 1)
+        self.assertEqual(
+            TextHash.objects.get(
+                kind=TextHash.COMMENT, object_id=comment.pk
+            ).duplicates, 2
+        )
+        self.assertEqual(flags[other.pk], 0)
+
+    def test_count_capped_and_listed_in_admin(self):
+        with mock.patch.object(simhash, 'MAX_CANDIDATES', 2):
+            for _ in range(4):
+                post = Post.objects.create(text=self.TEXT, author=self.user)
+        self.assertEqual(
+            TextHash.objects.get(object_id=post.pk).duplicates, 2
+        )
+        admin = get_user_model().objects.create_superuser(
+            'moderator', 'moderator@example.com', 'password'
+        )
+        client = Client()
+        client.force_login(admin)
+        response = client.get(
+            reverse('admin:posts_texthash_changelist'), {'repeated': 'yes'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_clusters_of_nearby_hashes(self):
+        base = 0x0123456789abcdef
+        hashes = {
+            'base': base,
+            'copy': base,
+            'near': base ^ 1 << 3 ^ 1 << 20 ^ 1 << 40,
+            'far': base ^ 0xffff << 8,
+        }
+        self.assertEqual(
+            duplicates.duplicate_clusters(hashes),
+            [['base', 'copy', 'near']]
+        )
+
+    def test_short_texts_skipped(self):
+        self.assertIsNone(simhash.simhash('Спасибо, отличный пост!'))
+        post = Post.objects.create(text='Спасибо!', author=self.user)
+        self.assertFalse(
+            TextHash.objects.filter(object_id=post.pk).exists()
+        )
+
+    def test_report_command(self):
+        first = Post.objects.create(text=self.TEXT, author=self.user)
+        comment = Comment.objects.create(
+            post=first, author=self.user, text=self.TEXT
+        )
+        TextHash.objects.all().delete()
+        out = StringIO()
+        call_command('find_duplicate_texts', stdout=out)
+        self.assertIn(
+            f'2: comment:{comment.pk} post:{first.pk}', out.getvalue()
+        )
+        self.assertIn('hashed=2 texts=2 clusters=1', out.getvalue())
@@ -0,0 +1,139 @@
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.test import Client, RequestFactory, TestCase, override_settings
+
+from yatube.staticfiles import StaticFilesMiddleware, accepted_encodings
+
+STYLE = b'body { color: #333; }\n' * 200
+
+
+class StaticFilesTest(TestCase):
+    """Статика с хешем в имени отдаётся готовой сжатой копией"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        os.makedirs(os.path.join(self.root, 'css'))
+        with open(os.path.join(self.root, 'css', 'site.css'), 'wb') as f:
+            f.write(STYLE)
+        settings = override_settings(STATIC_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('build_static', stdout=StringIO())
+        self.url = static('css/site.css')
+
+    def test_hashed_name_and_gzip_variant(self):
+        self.assertRegex(self.url, r'^/static/css/site\.[0-9a-f]{12}\.css$')
+        response = Client().get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        body = b''.join(response.streaming_content)
+        self.assertEqual(gzip.decompress(body), STYLE)
+
+    def test_identity_when_gzip_not_accepted(self):
+        response = Client().get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), STYLE)
+
+    def test_head_sends_headers_only(self):
+        request = RequestFactory().head(
+            self.url, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        response = StaticFilesMiddleware(None)(request)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(
+            int(response['Content-Length']),
+            len(gzip.compress(STYLE, compresslevel=9, mtime=0))
+        )
+
+    @override_settings(STATICFILES_MANIFEST_STRICT=True)
+    def test_missing_manifest_entry_is_an_error(self):
+        with self.assertRaises(ValueError):
+            static('css/missing.css')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(
+            accepted_encodings('gzip;q=0.5, br, deflate;q=0, *;q=0'),
+            {'gzip', 'br'}
+        )
+
+
+class MediaViewTest(TestCase):
+    """Медиа отдаются с ETag, Range и выгрузкой на веб-сервер"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        os.makedirs(os.path.join(self.root, 'posts'))
+        self.data = bytes(range(256)) * 4
+        with open(os.path.join(self.root, 'posts', 'a.png'), 'wb') as f:
+            f.write(self.data)
+        settings = override_settings(MEDIA_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.url = '/media/posts/a.png'
+
+    def test_full_file_and_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        cases = {
+            'bytes=0-9': (0, 9),
+            'bytes=1000-': (1000, 1023),
+            'bytes=-24': (1000, 1023),
+            'bytes=1020-5000': (1020, 1023),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(
+                    response['Content-Range'], f'bytes {start}-{end}/1024'
+                )
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.data[start:end + 1]
+                )
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(
+            self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_offload(self):
+        with override_settings(MEDIA_OFFLOAD='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/posts/a.png'
+        )
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_OFFLOAD='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(self.root, 'posts', 'a.png')
+        )
+
+    def test_outside_media_root(self):
+        for path in ('/media/../manage.py', '/media/posts/', '/media/nope'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
@@ -150,3 +150,35 @@ class StaticURLTests(TestCase):
             with self.subTest(reverse_name=reverse_name):
                 response = self.guest_client.get(reverse_name)
                 self.assertEqual(status_code, response.status_code)
+
+
+class ReservedUsernameTest(TestCase):
+    """Имена, занятые разделами сайта, при регистрации не выдаются"""
+
+    def signup(self, username):
+        return self.client.post(reverse('signup'), {
+            'username': username,
+            'password1': 'Xq9-long-password',
+            'password2': 'Xq9-long-password',
+        })
+
+    def test_section_names_rejected(self):
+        for username in ('trending', 'mentions', 'group', 'tag', 'new'):
+            with self.subTest(username=username):
+                response = self.signup(username)
+                self.assertFormError(
+                    response, 'form', 'username',
+                    'Это имя занято разделом сайта, выберите другое.'
+                )
+                self.assertFalse(
+                    get_user_model().objects.filter(
+                        username=username
+                    ).exists()
+                )
+
+    def test_free_name_gets_profile(self):
+        self.assertEqual(self.signup('trendsetter').status_code, 302)
+        response = self.client.get(
+            reverse('profile', args=['trendsetter'])
+        )
+        self.assertEqual(response.context['author'].username, 'trendsetter')
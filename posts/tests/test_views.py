@@ -1,15 +1,36 @@
+import hashlib
 import shutil
 import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from posts.models import Comment, Follow, Group, Post
+from posts import (counters, follows, live, notifications, tags, timeline,
+                   trending)
+from posts.feeds import FeedPost
+from posts.models import (Comment, Follow, FollowSuggestion, Group,
+                          GroupFollow, Mention, Post, PostTag, RelatedPost,
+                          Tag, TimelineEntry)
+from posts.precomputed import replace_rows
+from posts.related import compute_related, related_posts
+from posts.storage import sharded_name
+from posts.suggestions import compute_suggestions
+from posts.templatetags.paginator_tags import page_window
+from posts.text import render_with_mentions
+from posts.timeline import FollowFeed
 
 
 class PostsViewTests(TestCase):
@@ -53,6 +74,7 @@ class PostsViewTests(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.guest_user = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -153,7 +175,7 @@ class PostsViewTests(TestCase):
 
         context_post = {
             all_post_count: response.context['paginator'].count,
-            self.PAGE_TEXT: resp_page.text,
+            self.PAGE_TEXT: resp_page.preview_html,
             self.AUTH_USER_NAME: resp_page.author.username,
             f'{self.PAGE_GROUP}1': resp_page.group.title
         }
@@ -172,7 +194,7 @@ class PostsViewTests(TestCase):
         resp_group = response.context['group']
 
         context_group = {
-            self.PAGE_TEXT: resp_page.text,
+            self.PAGE_TEXT: resp_page.preview_html,
             self.AUTH_USER_NAME: resp_page.author.username,
             f'{self.PAGE_GROUP}1': resp_group.title,
             f'{self.GROUP_SLUG}1': resp_group.slug,
@@ -215,7 +237,7 @@ class PostsViewTests(TestCase):
         resp_page = response.context['page'][0]
 
         context_edit_page = {
-            self.PAGE_TEXT: resp_page.text,
+            self.PAGE_TEXT: resp_page.preview_html,
             f'{self.PAGE_GROUP}1': resp_page.group.title,
             self.AUTH_USER_NAME: resp_page.author.username,
         }
@@ -258,7 +280,9 @@ class PostsViewTests(TestCase):
         post = Post.objects.first()
         response = self.authorized_client.get(
             reverse('group_posts', kwargs={'slug': f'{self.GROUP_SLUG}1'}))
-        self.assertEqual(post.text, response.context.get('page')[0].text)
+        self.assertEqual(
+            post.preview_html, response.context.get('page')[0].preview_html
+        )
 
     def test_post_added_in_correct_group(self):
         """Тестирование на правильность назначения групп для постов"""
@@ -317,6 +341,9 @@ class PostImageViewTest(TestCase):
             content=cls.small_gif,
             content_type='image/gif'
         )
+        cls.expected_name = sharded_name(
+            'posts/small.gif', hashlib.sha256(cls.small_gif).hexdigest()
+        )
         cls.user = get_user_model().objects.create(
             username=cls.AUTH_USER_NAME
         )
@@ -337,6 +364,7 @@ class PostImageViewTest(TestCase):
         super().tearDownClass()
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_follower = Client()
         self.authorized_follower.force_login(self.follower)
@@ -357,7 +385,7 @@ class PostImageViewTest(TestCase):
         """Проверяем context страницы index на наличие изображения"""
         response = self.guest_client.get(reverse('index'))
         response_data_image = response.context['page'][0].image
-        expected = f'posts/{self.uploaded.name}'
+        expected = self.expected_name
 
         self.assertEqual(response_data_image, expected)
 
@@ -372,7 +400,7 @@ class PostImageViewTest(TestCase):
             )
         )
         response_data_image = response.context['page'][0].image
-        expected = f'posts/{self.uploaded.name}'
+        expected = self.expected_name
 
         self.assertEqual(response_data_image, expected)
 
@@ -387,7 +415,7 @@ class PostImageViewTest(TestCase):
             )
         )
         response_data_image = response.context['page'][0].image
-        expected = f'posts/{self.uploaded.name}'
+        expected = self.expected_name
 
         self.assertEqual(response_data_image, expected)
 
@@ -403,7 +431,7 @@ class PostImageViewTest(TestCase):
             )
         )
         response_data_image = response.context['post'].image
-        expected = f'posts/{self.uploaded.name}'
+        expected = self.expected_name
 
         self.assertEqual(response_data_image, expected)
 
@@ -423,6 +451,9 @@ class PaginatorViewsTest(TestCase):
             author=cls.user)
             for i in range(cls.POSTS_COUNT)])
 
+    def setUp(self):
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         """Тестируем Paginator.Первые 10 постов на первой странице"""
         response = self.client.get(reverse('index'))
@@ -437,6 +468,1121 @@ class PaginatorViewsTest(TestCase):
             len(response.context.get('page').object_list),
             self.POSTS_COUNT - self.POSTS_IN_PAGE)
 
+    def test_index_queries_do_not_depend_on_page_size(self):
+        """Лента строится фиксированным числом запросов"""
+        cache.clear()
+        # COUNT, строки ленты с JOIN, счётчики комментариев
+        with self.assertNumQueries(3):
+            self.client.get(reverse('index'))
+
+    def test_feed_rows_are_lightweight(self):
+        """В ленту попадают облегчённые строки, а не экземпляры Post"""
+        response = self.client.get(reverse('index'))
+        row = response.context['page'][0]
+        self.assertIsInstance(row, FeedPost)
+        self.assertFalse(hasattr(row, '__dict__'))
+        self.assertEqual(row.author.username, self.user.username)
+
+
+class PageWindowTest(TestCase):
+    """Окно номеров страниц не растёт вместе с числом страниц"""
+
+    def get_window(self, number, count):
+        paginator = Paginator(range(count), 10)
+        return page_window(paginator.page(number))
+
+    def test_few_pages_are_listed_completely(self):
+        self.assertEqual(self.get_window(1, 50), [1, 2, 3, 4, 5])
+
+    def test_window_is_elided(self):
+        self.assertEqual(
+            self.get_window(5000, 1000000),
+            [1, None, 4998, 4999, 5000, 5001, 5002, None, 100000]
+        )
+        self.assertEqual(
+            self.get_window(1, 1000000), [1, 2, 3, None, 100000]
+        )
+        self.assertEqual(
+            self.get_window(100000, 1000000),
+            [1, None, 99998, 99999, 100000]
+        )
+
+    def test_paginator_html_size_is_bounded(self):
+        user = get_user_model().objects.create(username='Many')
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=user) for i in range(300)
+        )
+        cache.clear()
+        response = self.client.get(reverse('index') + '?page=15')
+        self.assertContains(response, 'class="page-link" href="?page=', 8)
+
+
+class CommentPreviewsTest(TestCase):
+    """Последние комментарии в ленте загружаются одним запросом"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='Commenter')
+        for i in range(3):
+            post = Post.objects.create(text=f'Пост {i}', author=cls.user)
+            for j in range(5):
+                Comment.objects.create(
+                    post=post, author=cls.user, text=f'Коммент {i}-{j}'
+                )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_latest_comments_attached(self):
+        response = self.client.get(reverse('index'))
+        for row in response.context['page']:
+            self.assertEqual(
+                [comment.preview_html for comment in row.latest_comments],
+                [
+                    text for text in Comment.objects.filter(
+                        post_id=row.id
+                    ).values_list('preview_html', flat=True)[:3]
+                ]
+            )
+        self.assertContains(response, 'Коммент 2-4')
+        self.assertNotContains(response, 'Коммент 2-1')
+
+    def test_latest_comments_single_query(self):
+        # COUNT, строки ленты, счётчики комментариев, комментарии
+        with self.assertNumQueries(4):
+            self.client.get(reverse('index'))
+
+
+class FollowFeedTest(TestCase):
+    """Лента подписок сливает посты авторов и сообществ"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        user_model = get_user_model()
+        cls.reader = user_model.objects.create(username='Reader')
+        cls.author = user_model.objects.create(username='Followed')
+        cls.stranger = user_model.objects.create(username='Stranger')
+        cls.group = Group.objects.create(title='Группа', slug='followed')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        GroupFollow.objects.create(user=cls.reader, group=cls.group)
+        cls.posts = [
+            Post.objects.create(text='Автор', author=cls.author),
+            Post.objects.create(text='Чужой', author=cls.stranger),
+            Post.objects.create(
+                text='Группа', author=cls.stranger, group=cls.group
+            ),
+            Post.objects.create(
+                text='Автор в группе', author=cls.author, group=cls.group
+            ),
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_feed_merges_sources_without_duplicates(self):
+        response = self.client.get(reverse('follow_index'))
+        expected = [self.posts[3].id, self.posts[2].id, self.posts[0].id]
+        self.assertEqual(
+            [row.id for row in response.context['page']], expected
+        )
+        self.assertEqual(response.context['paginator'].count, 3)
+
+    def test_feed_queries_do_not_grow_with_subscriptions(self):
+        user_model = get_user_model()
+        for i in range(100):
+            author = user_model.objects.create(username=f'many{i}')
+            Follow.objects.create(user=self.reader, author=author)
+            Post.objects.create(text=f'Пост {i}', author=author)
+        feed = FollowFeed(self.reader)
+        feed.count()
+        with self.assertNumQueries(0):
+            feed.count()
+        with self.assertNumQueries(5):
+            # push-лента, авторы с неразосланными постами, головы
+            # потоков групп, строки страницы и счётчики комментариев
+            rows = feed[0:10]
+        self.assertEqual(len(rows), 10)
+        # обычные авторы не читаются потоками
+        self.assertEqual(feed.pull_ids(), [])
+
+    def test_stream_heads_limited_per_source(self):
+        author, stranger = self.author.id, self.stranger.id
+        with CaptureQueriesContext(connection) as queries:
+            heads = timeline.stream_heads('author_id', [author, stranger], 1)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]['sql'].count('LIMIT 1'), 2)
+        self.assertEqual(
+            sorted(post_id for stream in heads for _, post_id in stream),
+            [self.posts[2].id, self.posts[3].id]
+        )
+
+    def test_posts_are_pushed_to_followers(self):
+        post = Post.objects.create(text='Новый', author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+
+    def test_celebrity_posts_are_pulled(self):
+        with mock.patch.object(timeline, 'CELEBRITY_FOLLOWERS', 1):
+            post = Post.objects.create(text='Звезда', author=self.author)
+            self.assertFalse(
+                TimelineEntry.objects.filter(post=post).exists()
+            )
+            response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['page'][0].id, post.id)
+
+    def test_celebrity_posts_survive_losing_followers(self):
+        with mock.patch.object(timeline, 'CELEBRITY_FOLLOWERS', 1):
+            starred = Post.objects.create(text='Звезда', author=self.author)
+        latest = Post.objects.create(text='Обычный', author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(post=latest).exists()
+        )
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(
+            [row.id for row in response.context['page']][:2],
+            [latest.id, starred.id]
+        )
+
+    def test_backfill_is_one_page(self):
+        Post.objects.bulk_create([
+            Post(text=f'Старый {i}', author=self.stranger, pushed=True)
+            for i in range(settings.PER_PAGE + 2)
+        ])
+        self.client.get(
+            reverse('profile_follow', kwargs={'username': self.stranger})
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(
+                user=self.reader, post__author=self.stranger
+            ).count(),
+            settings.PER_PAGE
+        )
+
+    def test_follow_backfills_and_unfollow_forgets(self):
+        self.client.get(
+            reverse('profile_unfollow', kwargs={'username': self.author})
+        )
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.client.get(
+            reverse('profile_follow', kwargs={'username': self.author})
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+
+    def test_group_follow_and_unfollow(self):
+        GroupFollow.objects.all().delete()
+        self.client.get(
+            reverse('group_follow', kwargs={'slug': self.group.slug})
+        )
+        self.assertTrue(
+            GroupFollow.objects.filter(
+                user=self.reader, group=self.group
+            ).exists()
+        )
+        self.client.get(
+            reverse('group_unfollow', kwargs={'slug': self.group.slug})
+        )
+        self.assertFalse(GroupFollow.objects.exists())
+
+
+class NewPostsCountTest(TestCase):
+    """Опрос новых постов отвечает по водяным знакам лент"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = get_user_model().objects.create(username='Poller')
+        cls.group = Group.objects.create(title='Группа', slug='polled')
+        cls.first = Post.objects.create(text='Первый', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def poll(self, **params):
+        return self.client.get(reverse('new_posts_count'), params).json()
+
+    def test_new_posts_are_counted(self):
+        Post.objects.create(text='Второй', author=self.author)
+        Post.objects.create(
+            text='Третий', author=self.author, group=self.group
+        )
+        self.assertEqual(self.poll(since=self.first.id)['count'], 2)
+        self.assertEqual(
+            self.poll(feed='group', slug='polled', since=0)['count'], 1
+        )
+        self.assertEqual(
+            self.poll(feed='profile', username='Poller', since=0)['count'],
+            3
+        )
+
+    def test_follow_feed(self):
+        reader = get_user_model().objects.create(username='Follower')
+        Follow.objects.create(user=reader, author=self.author)
+        self.client.force_login(reader)
+        self.assertEqual(self.poll(feed='follow', since=0)['count'], 1)
+        self.assertEqual(
+            self.poll(feed='follow', since=self.first.id)['count'], 0
+        )
+
+    def test_up_to_date_client_costs_no_queries(self):
+        with mock.patch.object(counters, 'SHARED_CACHE', True):
+            latest = self.poll()['latest']
+            with self.assertNumQueries(0):
+                self.assertEqual(self.poll(since=latest)['count'], 0)
+
+    def test_local_watermark_is_not_trusted(self):
+        latest = self.poll()['latest']
+        # другой процесс добавил пост, не сдвинув водяной знак здесь
+        cache.set(counters.watermark_key('all'), latest)
+        Post.objects.bulk_create([Post(text='Чужой', author=self.author)])
+        self.assertEqual(self.poll(since=latest)['count'], 1)
+
+    def test_bad_request(self):
+        response = self.client.get(
+            reverse('new_posts_count'), {'since': 'x'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class LiveCommentsTest(TestCase):
+    """Новые комментарии рассылаются всем зрителям поста"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='Live')
+        cls.post = Post.objects.create(text='Обсуждение', author=cls.user)
+
+    def setUp(self):
+        self.broadcaster = live.CommentBroadcaster(autostart=False)
+
+    def test_poll_errors_do_not_stop_thread(self):
+        class Stop(Exception):
+            pass
+
+        failing_poll = mock.patch.object(
+            self.broadcaster, 'poll_once',
+            side_effect=[DatabaseError('database is locked'), None]
+        )
+        with mock.patch.object(live.time, 'sleep',
+                               side_effect=[None, None, Stop]), \
+                failing_poll as poll, \
+                self.assertLogs('posts.live', 'ERROR'):
+            with self.assertRaises(Stop):
+                self.broadcaster.run()
+        self.assertEqual(poll.call_count, 2)
+
+    def test_one_query_for_all_subscribers(self):
+        listeners = [self.broadcaster.subscribe(self.post.id)
+                     for _ in range(50)]
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Живой <b>коммент</b>'
+        )
+        with self.assertNumQueries(1):
+            self.broadcaster.poll_once()
+        for listener in listeners:
+            comment_id, fragment = listener.get_nowait()
+            self.assertEqual(comment_id, comment.id)
+            self.assertIn('Живой &lt;b&gt;коммент&lt;/b&gt;', fragment)
+        with self.assertNumQueries(1):
+            self.broadcaster.poll_once()
+        self.assertTrue(listeners[0].empty())
+
+    def test_idle_broadcaster_sends_only_new_comments(self):
+        first = self.broadcaster.subscribe(self.post.id)
+        self.broadcaster.unsubscribe(self.post.id, first)
+        for text in ('Раз', 'Два', 'Три'):
+            Comment.objects.create(post=self.post, author=self.user, text=text)
+        self.broadcaster.poll_once()
+        listener = self.broadcaster.subscribe(self.post.id)
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Новый'
+        )
+        self.broadcaster.poll_once()
+        self.assertEqual(listener.get_nowait()[0], comment.id)
+        self.assertTrue(listener.empty())
+
+    def test_stream_resumes_after_last_event_id(self):
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Пропущенный'
+        )
+        with mock.patch.object(live, 'broadcaster', self.broadcaster):
+            response = self.client.get(
+                reverse('comments_stream', args=(self.user, self.post.id)),
+                HTTP_LAST_EVENT_ID=str(comment.id - 1)
+            )
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = response.streaming_content
+            self.assertTrue(next(events).startswith(b'retry:'))
+            event = next(events).decode()
+            response.close()
+        self.assertIn(f'id: {comment.id}', event)
+        self.assertIn('Пропущенный', event)
+        self.assertEqual(self.broadcaster.subscribers, {})
+
+
+class AjaxCommentTest(TestCase):
+    """Комментарий можно отправить без перезагрузки страницы"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='Ajax')
+        cls.post = Post.objects.create(text='Пост', author=cls.user)
+        cls.url = reverse('add_comment', args=(cls.user, cls.post.id))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_json_response(self):
+        counters.comment_counts([self.post.id])
+        response = self.client.post(
+            self.url, {'text': 'Через fetch'}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        comment = Comment.objects.get(post=self.post)
+        self.assertEqual(data['id'], comment.id)
+        self.assertIn('Через fetch', data['html'])
+        self.assertEqual(data['comment_count'], 1)
+
+    def test_json_errors(self):
+        response = self.client.post(
+            self.url, {'text': ''}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertTrue(errors['text'][0]['message'])
+        self.assertFalse(Comment.objects.exists())
+
+    def test_fragment_response(self):
+        response = self.client.post(
+            self.url, {'text': 'Фрагмент'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTemplateUsed(
+            response, 'posts/includes/comment_item.html'
+        )
+        self.assertNotContains(response, '<html', status_code=201)
+
+
+class FollowingStateTest(TestCase):
+    """Кнопка подписки знает, подписан ли пользователь"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        user_model = get_user_model()
+        cls.reader = user_model.objects.create(username='Viewer')
+        cls.authors = [
+            user_model.objects.create(username=f'author{i}')
+            for i in range(5)
+        ]
+        for author in cls.authors:
+            Post.objects.create(text='Пост', author=author)
+        Follow.objects.create(user=cls.reader, author=cls.authors[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_profile_and_post_pages(self):
+        author = self.authors[0]
+        response = self.client.get(reverse('profile', args=(author,)))
+        self.assertTrue(response.context['following'])
+        response = self.client.get(
+            reverse('profile', args=(self.authors[1],))
+        )
+        self.assertFalse(response.context['following'])
+        post = author.posts.get()
+        response = self.client.get(reverse('post', args=(author, post.id)))
+        self.assertTrue(response.context['following'])
+
+    def test_profile_cards_follow_sidebar(self):
+        author = self.authors[0]
+        response = self.client.get(reverse('profile', args=(author,)))
+        self.assertTrue(
+            all(row.author.following for row in response.context['page'])
+        )
+        self.assertNotContains(response, 'Подписаться')
+
+    def test_feed_rows_resolved_with_one_lookup(self):
+        followed = {self.authors[0].id}
+        self.assertEqual(
+            follows.following_ids(
+                self.reader, [author.id for author in self.authors]
+            ),
+            followed
+        )
+        with self.assertNumQueries(0):
+            follows.following_ids(self.reader, [self.authors[1].id])
+        response = self.client.get(reverse('index'))
+        for row in response.context['page']:
+            self.assertEqual(row.author.following, row.author.id in followed)
+
+    def test_follow_resets_cached_set(self):
+        follows.following_ids(self.reader, [self.authors[1].id])
+        self.client.get(reverse('profile_follow', args=(self.authors[1],)))
+        self.assertEqual(
+            follows.following_ids(self.reader, [self.authors[1].id]),
+            {self.authors[1].id}
+        )
+
+
+class FollowWriteTest(TransactionTestCase):
+    """Подписка и отписка одним запросом на запись"""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.reader = user_model.objects.create(username='Reader')
+        self.authors = [
+            user_model.objects.create(username=f'writer{i}')
+            for i in range(3)
+        ]
+        for author in self.authors:
+            Post.objects.create(text='Пост', author=author)
+        self.client.force_login(self.reader)
+
+    def writes(self, queries):
+        table = f'"{Follow._meta.db_table}"'
+        return [
+            query['sql'] for query in queries
+            if f'INTO {table} ' in query['sql']
+            or query['sql'].lstrip().startswith(f'DELETE FROM {table} ')
+        ]
+
+    def test_follow_is_single_insert_and_idempotent(self):
+        author = self.authors[0]
+        counters.follower_counts([author.id])
+        with CaptureQueriesContext(connection) as queries:
+            follows.follow(self.reader, [author.id])
+        self.assertEqual(len(self.writes(queries)), 1)
+        follows.follow(self.reader, [author.id])
+        self.assertEqual(Follow.objects.filter(author=author).count(), 1)
+        self.assertEqual(counters.follower_counts([author.id])[author.id], 1)
+        self.assertEqual(follows.follow(self.reader, [self.reader.id]), set())
+
+    def test_unfollow_is_single_delete(self):
+        author = self.authors[0]
+        follows.follow(self.reader, [author.id])
+        counters.follower_counts([author.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('profile_unfollow', args=(author,)))
+        self.assertEqual(len(self.writes(queries)), 1)
+        self.assertFalse(Follow.objects.filter(author=author).exists())
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.reader).exists()
+        )
+        self.assertEqual(counters.follower_counts([author.id])[author.id], 0)
+
+    def test_changes_returned_by_the_write_itself(self):
+        author = self.authors[0]
+        table = Follow._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                follows.follow(self.reader, [author.id]), {author.id}
+            )
+            self.assertEqual(follows.follow(self.reader, [author.id]), set())
+            self.assertEqual(
+                follows.unfollow(self.reader, [author.id]), {author.id}
+            )
+        self.assertEqual(
+            len([q for q in queries if table in q['sql']]), 3
+        )
+
+    def test_fallback_without_returning(self):
+        author = self.authors[0]
+        with mock.patch.object(follows, 'RETURNING', False):
+            self.assertEqual(
+                follows.follow(self.reader, [author.id]), {author.id}
+            )
+            self.assertEqual(follows.follow(self.reader, [author.id]), set())
+            self.assertEqual(
+                follows.unfollow(self.reader, [author.id]), {author.id}
+            )
+        self.assertFalse(Follow.objects.exists())
+
+    def test_changes_counted_from_database(self):
+        author = self.authors[0]
+        counters.follower_counts([author.id])
+        follows.followed_author_ids(self.reader.id)
+        Follow.objects.create(user=self.reader, author=author)
+        self.assertEqual(follows.follow(self.reader, [author.id]), set())
+        self.assertEqual(counters.follower_counts([author.id])[author.id], 0)
+
+    def test_rolled_back_follow_keeps_counters(self):
+        author = self.authors[0]
+        counters.follower_counts([author.id])
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                follows.follow(self.reader, [author.id])
+                raise DatabaseError
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(counters.follower_counts([author.id])[author.id], 0)
+        self.assertEqual(
+            follows.following_ids(self.reader, [author.id]), set()
+        )
+
+    def test_bulk_endpoint(self):
+        follows.follow(self.reader, [self.authors[2].id])
+        response = self.client.post(reverse('follow_bulk'), {
+            'follow': ['writer0', 'writer1', 'nobody'],
+            'unfollow': ['writer2'],
+        })
+        self.assertEqual(
+            response.json(), {'following': ['writer0', 'writer1']}
+        )
+        self.assertEqual(
+            set(Follow.objects.filter(user=self.reader).values_list(
+                'author__username', flat=True
+            )),
+            {'writer0', 'writer1'}
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+        response = self.client.get(reverse('follow_bulk'))
+        self.assertEqual(response.status_code, 405)
+
+
+class FollowSuggestionsTest(TestCase):
+    """Рекомендации «на кого подписаться» считаются заранее"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        user_model = get_user_model()
+        cls.users = {
+            name: user_model.objects.create(username=name)
+            for name in ('reader', 'anna', 'boris', 'clara', 'denis')
+        }
+        for user, author in (('reader', 'anna'), ('anna', 'boris'),
+                             ('clara', 'anna'), ('clara', 'denis')):
+            Follow.objects.create(
+                user=cls.users[user], author=cls.users[author]
+            )
+
+    def setUp(self):
+        cache.clear()
+        call_command('build_follow_suggestions', stdout=StringIO())
+        self.client.force_login(self.users['reader'])
+
+    def test_friends_of_friends_rank_above_cofollows(self):
+        suggestions = FollowSuggestion.objects.filter(
+            user=self.users['reader']
+        ).order_by('-score')
+        self.assertEqual(
+            [suggestion.author.username for suggestion in suggestions],
+            ['boris', 'denis']
+        )
+
+    def test_served_with_one_query(self):
+        follows.followed_author_ids(self.users['reader'].id)
+        with self.assertNumQueries(1):
+            authors = follows.suggested_authors(self.users['reader'])
+        self.assertEqual(
+            authors, [self.users['boris'], self.users['denis']]
+        )
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(response.context['suggestions'], authors)
+
+    def test_followed_authors_skipped(self):
+        self.client.get(reverse('profile_follow', args=('boris',)))
+        response = self.client.get(reverse('profile', args=('anna',)))
+        self.assertEqual(
+            response.context['suggestions'], [self.users['denis']]
+        )
+
+    def test_table_replaced_in_batches(self):
+        stale = FollowSuggestion.objects.create(
+            user=self.users['denis'], author=self.users['anna'], score=1
+        )
+        old = set(FollowSuggestion.objects.values_list('user_id', 'pk'))
+
+        def compute():
+            for suggestion in compute_suggestions(5):
+                # строки пользователей дальше по id ещё не тронуты
+                self.assertEqual(
+                    set(FollowSuggestion.objects.filter(
+                        user_id__gte=suggestion.user_id
+                    ).values_list('user_id', 'pk')),
+                    {row for row in old if row[0] >= suggestion.user_id}
+                )
+                yield suggestion
+
+        written = replace_rows(FollowSuggestion, 'user', compute(), 1)
+        self.assertEqual(written, FollowSuggestion.objects.count())
+        self.assertFalse(FollowSuggestion.objects.filter(pk=stale.pk).exists())
+        self.assertEqual(
+            follows.suggested_authors(self.users['reader']),
+            [self.users['boris'], self.users['denis']]
+        )
+
+
+class RelatedPostsTest(TestCase):
+    """Похожие посты считаются ночью и читаются одним запросом"""
+    TEXTS = (
+        'Рецепт борща со свёклой, капустой и говядиной на обед',
+        'Постный борщ со свёклой и капустой без говядины',
+        'Сравнили видеокарты для игр и монтажа видео',
+        'Какую видеокарту выбрать для монтажа видео',
+        'Фотографии с прогулки по осеннему парку',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='cook')
+        cls.posts = [
+            Post.objects.create(text=text, author=cls.user)
+            for text in cls.TEXTS
+        ]
+
+    def setUp(self):
+        cache.clear()
+        call_command('build_related_posts', '--max-df=0.5', stdout=StringIO())
+
+    def test_nearest_by_text(self):
+        borsch, lenten, cards, choice, park = self.posts
+        self.assertEqual(related_posts(borsch, 5), [lenten])
+        self.assertEqual(related_posts(choice, 5), [cards])
+        self.assertEqual(related_posts(park, 5), [])
+
+    def test_served_with_one_query(self):
+        borsch, lenten = self.posts[:2]
+        with self.assertNumQueries(1):
+            posts = related_posts(lenten, 5)
+            self.assertEqual(posts[0].author.username, 'cook')
+        response = self.client.get(
+            reverse('post', args=('cook', lenten.id))
+        )
+        self.assertEqual(response.context['related_posts'], [borsch])
+        self.assertContains(response, 'Похожие посты')
+
+    def test_written_while_computing(self):
+        borsch, lenten, cards, choice, park = self.posts
+        stale = RelatedPost.objects.create(post=park, related=cards, score=1)
+        computed = list(compute_related(5, max_df=0.5))
+        written_before = []
+
+        def compute():
+            for item in computed:
+                written_before.append(set(RelatedPost.objects.filter(
+                    post_id__lt=item.post_id
+                ).values_list('post_id', 'related_id')))
+                yield item
+
+        replace_rows(RelatedPost, 'post', compute(), 1)
+        # строки предыдущих постов записаны до расчёта следующих
+        self.assertEqual(
+            written_before[-1],
+            {(item.post_id, item.related_id) for item in computed
+             if item.post_id < computed[-1].post_id}
+        )
+        self.assertFalse(RelatedPost.objects.filter(pk=stale.pk).exists())
+        self.assertEqual(related_posts(borsch, 5), [lenten])
+
+
+class TagFeedTest(TestCase):
+    """Теги разбираются при сохранении, лента тега листается курсором"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username='tagger')
+
+    def tag_names(self, post):
+        return sorted(
+            PostTag.objects.filter(post=post).values_list(
+                'tag__name', flat=True
+            )
+        )
+
+    def test_tags_follow_text(self):
+        post = Post.objects.create(
+            text='Учу #Python и #Django, #python', author=self.user
+        )
+        self.assertEqual(self.tag_names(post), ['django', 'python'])
+        post.text = 'Учу #Django и #SQL'
+        post.save()
+        self.assertEqual(self.tag_names(post), ['django', 'sql'])
+        self.assertEqual(
+            PostTag.objects.get(post=post, tag__name='sql').pub_date,
+            post.pub_date
+        )
+
+    def test_cursor_pages(self):
+        posts = [
+            Post.objects.create(text=f'Запись {i} #лента', author=self.user)
+            for i in range(settings.PER_PAGE + 2)
+        ]
+        Post.objects.create(text='Без тега', author=self.user)
+        url = reverse('tag_posts', args=('Лента',))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        feed_sql = [
+            query['sql'] for query in queries
+            if 'posts_posttag' in query['sql']
+        ]
+        self.assertEqual(len(feed_sql), 1)
+        self.assertNotIn('LIKE', feed_sql[0])
+        first = [post.id for post in response.context['posts']]
+        self.assertEqual(
+            first, [post.id for post in posts[::-1][:settings.PER_PAGE]]
+        )
+        cursor = response.context['next_cursor']
+        self.assertEqual(tags.decode_cursor(cursor)[1], first[-1])
+        response = self.client.get(url, {'before': cursor})
+        self.assertEqual(
+            [post.id for post in response.context['posts']],
+            [posts[1].id, posts[0].id]
+        )
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(
+            self.client.get(url, {'before': 'junk'}).context['posts'][0].id,
+            posts[-1].id
+        )
+        self.assertEqual(
+            self.client.get(reverse('tag_posts', args=('нет',))).status_code,
+            404
+        )
+
+    def test_backfill_command(self):
+        post = Post.objects.create(text='Старый #пост', author=self.user)
+        PostTag.objects.all().delete()
+        Tag.objects.all().delete()
+        Post.objects.filter(pk=post.pk).update(text_html='Старый #пост')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Про #пост'
+        )
+        Comment.objects.filter(pk=comment.pk).update(
+            text_html='Про <a href="/tag/пост/">#пост</a>'
+        )
+        out = StringIO()
+        call_command('backfill_tags', stdout=out)
+        self.assertEqual(self.tag_names(post), ['пост'])
+        self.assertIn('/tag/', Post.objects.get(pk=post.pk).text_html)
+        self.assertEqual(
+            Comment.objects.get(pk=comment.pk).text_html, 'Про #пост'
+        )
+        self.assertIn('posts=1 tagged=1 links=1 comments=1', out.getvalue())
+
+    def test_comment_tags_are_not_links(self):
+        post = Post.objects.create(text='Пост', author=self.user)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Согласен, #лето'
+        )
+        self.assertEqual(comment.text_html, 'Согласен, #лето')
+        self.assertFalse(Tag.objects.filter(name='лето').exists())
+
+
+class MentionTest(TransactionTestCase):
+    """@упоминания разрешаются при записи, уведомления пишутся пачками"""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.author = user_model.objects.create(username='writer')
+        self.anna = user_model.objects.create(username='anna')
+        self.boris = user_model.objects.create(username='boris.k')
+        self.notifier = notifications.MentionNotifier(
+            batch_size=2, autostart=False
+        )
+        patch = mock.patch.object(notifications, 'notifier', self.notifier)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_resolved_with_one_query(self):
+        with self.assertNumQueries(1):
+            text_html, _, ids = render_with_mentions(
+                'Привет, @anna и @boris.k. @ghost, пиши на a@anna.ru'
+            )
+        self.assertEqual(
+            text_html,
+            'Привет, <a href="/anna/">@anna</a> и '
+            '<a href="/boris.k/">@boris.k</a>. @ghost, пиши на a@anna.ru'
+        )
+        self.assertEqual(sorted(ids), [self.anna.id, self.boris.id])
+        with self.assertNumQueries(0):
+            render_with_mentions('Без упоминаний')
+
+    def test_notifications_batched(self):
+        post = Post.objects.create(
+            text='@anna, @boris.k и @writer', author=self.author
+        )
+        Comment.objects.create(post=post, author=self.anna, text='@writer!')
+        self.assertFalse(Mention.objects.exists())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.notifier.flush(), 3)
+        inserts = [
+            query for query in queries if 'INSERT' in query['sql']
+        ]
+        self.assertEqual(len(inserts), 2)
+        post.save()
+        self.notifier.flush()
+        self.assertEqual(
+            sorted(
+                (mention.user.username, mention.comment_id is None)
+                for mention in Mention.objects.select_related('user')
+            ),
+            [('anna', True), ('boris.k', True), ('writer', False)]
+        )
+
+    def test_deleted_targets_skipped(self):
+        Post.objects.create(text='Спроси @anna', author=self.author)
+        gone = Post.objects.create(text='Спроси @boris.k', author=self.author)
+        gone.delete()
+        self.assertEqual(self.notifier.flush(), 1)
+        self.assertEqual(
+            list(Mention.objects.values_list('user__username', flat=True)),
+            ['anna']
+        )
+
+    def test_failed_batch_does_not_stop_notifier(self):
+        Post.objects.create(text='Спроси @anna', author=self.author)
+        with mock.patch.object(
+            Mention.objects, 'bulk_create', side_effect=DatabaseError
+        ), self.assertLogs('posts.notifications', 'ERROR'):
+            self.assertEqual(self.notifier.flush(), 0)
+        Post.objects.create(text='Спроси @boris.k', author=self.author)
+        self.assertEqual(self.notifier.flush(), 1)
+        self.assertTrue(Mention.objects.filter(user=self.boris).exists())
+
+    def test_mentions_page(self):
+        post = Post.objects.create(text='Спроси @anna', author=self.author)
+        self.notifier.flush()
+        self.client.force_login(self.anna)
+        response = self.client.get(reverse('mentions'))
+        self.assertEqual(
+            [mention.post for mention in response.context['page']], [post]
+        )
+        self.assertContains(response, '<a href="/anna/">@anna</a>')
+
+    def test_backfill_command(self):
+        posts = [
+            Post.objects.create(text=text, author=self.author)
+            for text in ('Привет, @anna', 'И @boris.k', 'Без имён', '@ghost')
+        ]
+        comment = Comment.objects.create(
+            post=posts[0], author=self.anna, text='@writer, #спасибо'
+        )
+        Post.objects.update(text_html='старый')
+        Comment.objects.update(text_html='старый')
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_mentions', batch_size=2, stdout=out)
+        lookups = [
+            query for query in queries if 'auth_user' in query['sql']
+        ]
+        # пачка постов с "@" из двух, пачка из одного и пачка комментариев
+        self.assertEqual(len(lookups), 3)
+        self.assertIn('posts=3 comments=1', out.getvalue())
+        self.assertEqual(
+            Post.objects.get(pk=posts[0].pk).text_html,
+            'Привет, <a href="/anna/">@anna</a>'
+        )
+        self.assertEqual(
+            Post.objects.get(pk=posts[2].pk).text_html, 'старый'
+        )
+        self.assertEqual(Post.objects.get(pk=posts[3].pk).text_html, '@ghost')
+        self.assertEqual(
+            Comment.objects.get(pk=comment.pk).text_html,
+            '<a href="/writer/">@writer</a>, #спасибо'
+        )
+
+
+class TrendingTest(TestCase):
+    """Популярное по затухающему счёту, без агрегатов по комментариям"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='Trender')
+        cls.groups = [
+            Group.objects.create(title=f'Группа {i}', slug=f'trend-{i}')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.quiet = Post.objects.create(
+            text='Тихий', author=self.user, group=self.groups[0]
+        )
+        self.busy = Post.objects.create(
+            text='Обсуждаемый', author=self.user, group=self.groups[1]
+        )
+
+    def test_comment_adds_decayed_weight(self):
+        before = Post.objects.get(pk=self.busy.pk).trend_score
+        comment = Comment.objects.create(
+            post=self.busy, author=self.user, text='Комментарий'
+        )
+        expected = trending.log_sum([
+            before,
+            trending.log_weight(trending.COMMENT_WEIGHT, comment.created),
+        ])
+        self.busy.refresh_from_db()
+        self.assertAlmostEqual(self.busy.trend_score, expected, places=6)
+        self.groups[1].refresh_from_db()
+        self.assertGreater(self.groups[1].trend_score, before)
+
+    def test_half_life(self):
+        moment = self.busy.pub_date
+        later = moment + timedelta(seconds=settings.TREND_HALF_LIFE)
+        self.assertAlmostEqual(
+            trending.current_score(trending.log_weight(4, moment), later), 2
+        )
+
+    def test_ranking(self):
+        for _ in range(2):
+            Comment.objects.create(
+                post=self.busy, author=self.user, text='Комментарий'
+            )
+        response = self.client.get(reverse('trending'))
+        self.assertEqual(
+            [post.id for post in response.context['posts']][:2],
+            [self.busy.id, self.quiet.id]
+        )
+        self.assertEqual(list(response.context['groups']), [
+            self.groups[1], self.groups[0]
+        ])
+
+
+class GroupDirectoryTest(TestCase):
+    """Каталог сообществ читает сохранённые агрегаты"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = get_user_model().objects.create(username='Member')
+        cls.groups = [
+            Group.objects.create(title=f'Сообщество {i}', slug=f'dir-{i}')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_aggregates_follow_writes(self):
+        group, other = self.groups[:2]
+        first = Post.objects.create(text='1', author=self.user, group=group)
+        second = Post.objects.create(text='2', author=self.user, group=group)
+        self.client.get(reverse('group_follow', args=(group.slug,)))
+        self.client.get(reverse('group_follow', args=(group.slug,)))
+        group.refresh_from_db()
+        self.assertEqual(group.post_count, 2)
+        self.assertEqual(group.subscriber_count, 1)
+        self.assertEqual(group.last_activity, second.pub_date)
+
+        second.group = other
+        second.save()
+        first.delete()
+        self.client.get(reverse('group_unfollow', args=(group.slug,)))
+        group.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(
+            (group.post_count, group.last_activity, group.subscriber_count),
+            (0, None, 0)
+        )
+        self.assertEqual(other.post_count, 1)
+        self.assertEqual(other.last_activity, second.pub_date)
+
+    def test_deleted_member_unsubscribed(self):
+        group = self.groups[2]
+        member = get_user_model().objects.create(username='Leaving')
+        GroupFollow.objects.create(user=member, group=group)
+        GroupFollow.objects.create(user=self.user, group=group)
+        member.delete()
+        group.refresh_from_db()
+        self.assertEqual(group.subscriber_count, 1)
+
+    def test_rebuild_command(self):
+        group = self.groups[0]
+        post = Post.objects.create(text='1', author=self.user, group=group)
+        GroupFollow.objects.create(user=self.user, group=group)
+        Group.objects.update(post_count=7, subscriber_count=7)
+        call_command('rebuild_group_directory', stdout=StringIO())
+        group.refresh_from_db()
+        self.assertEqual(
+            (group.post_count, group.last_activity, group.subscriber_count),
+            (1, post.pub_date, 1)
+        )
+
+    def test_directory_page_is_one_query(self):
+        Post.objects.create(text='1', author=self.user, group=self.groups[1])
+        counters.group_count()
+        with self.assertNumQueries(1):
+            groups = list(Client().get(reverse('group_list')).context['page'])
+        self.assertEqual(groups[0], self.groups[1])
+        self.assertEqual(len(groups), 3)
+
+
+class CountersTest(TestCase):
+    """Счётчики лент поддерживаются записью, а не COUNT(*)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = get_user_model().objects.create(username='Counted')
+        cls.reader = get_user_model().objects.create(username='Reader')
+        cls.group = Group.objects.create(title='Группа', slug='counted')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_counters_follow_writes(self):
+        self.assertEqual(counters.post_count(), 0)
+        self.assertEqual(counters.group_post_count(self.group.id), 0)
+        self.assertEqual(FollowFeed(self.reader).count(), 0)
+        post = Post.objects.create(
+            text='Пост', author=self.author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text='Да')
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.post_count(), 1)
+            self.assertEqual(counters.group_post_count(self.group.id), 1)
+            self.assertEqual(counters.author_post_count(self.author.id), 1)
+        self.assertEqual(FollowFeed(self.reader).count(), 1)
+        self.assertEqual(counters.comment_counts([post.id]), {post.id: 1})
+
+        post.group = None
+        post.save()
+        self.assertEqual(counters.group_post_count(self.group.id), 0)
+        post.delete()
+        self.assertEqual(counters.post_count(), 0)
+        self.assertEqual(counters.author_post_count(self.author.id), 0)
+
+    def test_local_cache_keeps_counters_briefly(self):
+        self.assertFalse(counters.SHARED_CACHE)
+        self.assertEqual(counters.author_post_count(self.author.id), 0)
+        # запись в обход сигналов, как из другого процесса
+        Post.objects.bulk_create([Post(text='Пост', author=self.author)])
+        self.assertEqual(counters.author_post_count(self.author.id), 0)
+        later = time.time() + settings.LOCAL_CACHE_TIMEOUT + 1
+        with mock.patch(
+            'django.core.cache.backends.locmem.time.time', return_value=later
+        ):
+            self.assertEqual(counters.author_post_count(self.author.id), 1)
+
+    def test_listing_does_not_count_rows(self):
+        Post.objects.create(text='Пост', author=self.author)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index') + '?page=1')
+        self.assertFalse(
+            any('COUNT' in query['sql'] for query in queries.captured_queries)
+        )
+
 
 class CacheViewTest(TestCase):
     AUTHORIZED_USER_NAME = 'TestUser'
@@ -0,0 +1,95 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.template.defaultfilters import linebreaksbr
+from django.urls import reverse
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+from django.utils.text import Truncator
+
+PREVIEW_LENGTH = settings.PREVIEW_LENGTH
+MAX_TAG_LENGTH = 100
+# #тег - буквы, цифры и _, но не одни цифры («#1» - не тег)
+TAG = re.compile(r'(?<![\w&#])#(\w*[^\W\d]\w*)')
+# @имя - как в username, но точка или дефис в конце - уже не имя
+# («спасибо, @anna.»); перед @ не должно быть буквы, как в e-mail
+MENTION = re.compile(r'(?<![\w@])@(\w(?:[\w.+-]*\w)?)')
+TOKEN = re.compile(f'{TAG.pattern}|{MENTION.pattern}')
+
+
+def normalize_tag(name):
+    return name.casefold()
+
+
+def extract_tags(text):
+    """Нормализованные теги текста в порядке появления, без повторов."""
+    names = {}
+    for match in TAG.finditer(text):
+        name = normalize_tag(match.group(1))
+        if len(name) <= MAX_TAG_LENGTH:
+            names.setdefault(name, None)
+    return list(names)
+
+
+def extract_mentions(text):
+    """Имена из @упоминаний в порядке появления, без повторов."""
+    return list(dict.fromkeys(MENTION.findall(text)))
+
+
+def resolve_mentions(names):
+    """{username: id} существующих пользователей одним запросом."""
+    if not names:
+        return {}
+    return dict(
+        get_user_model().objects.filter(
+            username__in=names
+        ).values_list('username', 'id')
+    )
+
+
+def _link(match, mentions, tags):
+    tag, username = match.groups()
+    if tag is not None:
+        name = normalize_tag(tag)
+        if tags and len(name) <= MAX_TAG_LENGTH:
+            url = reverse('tag_posts', args=[name])
+            return format_html('<a href="{}">{}</a>', url, match.group(0))
+    elif username in mentions:
+        url = reverse('profile', args=[username])
+        return format_html('<a href="{}">{}</a>', url, match.group(0))
+    return escape(match.group(0))
+
+
+def render_text(text, mentions=(), tags=True):
+    """Экранированный HTML текста, как после ``linebreaksbr``, со
+    ссылками на профили из ``mentions`` - уже найденных пользователей
+    (см. resolve_mentions) - и, если ``tags``, на страницы тегов. Теги
+    индексируются только у постов, так что в комментариях они остаются
+    текстом."""
+    parts = []
+    position = 0
+    for match in TOKEN.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        parts.append(_link(match, mentions, tags))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return linebreaksbr(mark_safe(''.join(parts)), autoescape=False)
+
+
+def render_preview(text, mentions=(), tags=True):
+    """Обрезанная до ``PREVIEW_LENGTH`` символов версия ``render_text``."""
+    return render_text(
+        Truncator(text).chars(PREVIEW_LENGTH), mentions, tags
+    )
+
+
+def render_with_mentions(text, tags=True):
+    """HTML текста и превью для сохранения вместе с id упомянутых
+    пользователей: упоминания разрешаются при записи, а не при показе."""
+    mentions = resolve_mentions(extract_mentions(text))
+    return (
+        render_text(text, mentions, tags),
+        render_preview(text, mentions, tags),
+        list(mentions.values())
+    )
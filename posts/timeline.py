@@ -0,0 +1,263 @@
+"""Лента подписок: посты избранных авторов и сообществ.
+
+Посты обычных авторов при публикации рассылаются в TimelineEntry
+подписчиков (push) и отмечаются Post.pushed. Посты авторов с
+FEED_CELEBRITY_FOLLOWERS и более подписчиками не рассылаются и при
+чтении подтягиваются из потоков (pull). Pull-потоки читаются только
+для авторов, у которых есть неразосланные посты: их множество берётся
+по частичному индексу и кешируется (pull_author_ids), так что число
+потоков на чтение растёт с числом избранных знаменитостей, а не всех
+подписок. Посты, написанные, пока автор был знаменитостью, не
+пропадают, когда подписчиков становится меньше. Посты сообществ всегда
+подтягиваются при чтении.
+
+Новый подписчик получает в ленту первую страницу разосланных постов
+автора (backfill); более старые остаются в профиле автора.
+
+Каждый источник - уже упорядоченный индексом поток. Головы всех
+pull-потоков выбираются одним запросом (UNION ALL подзапросов с LIMIT
+по индексу каждого источника), push-поток - ещё одним, а затем всё
+сливается через heapq.merge вместо одного большого JOIN с OR по
+подпискам.
+"""
+import hashlib
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+from . import counters, follows
+from .feeds import load_feed_rows
+from .models import Follow, GroupFollow, Post, TimelineEntry
+
+CELEBRITY_FOLLOWERS = settings.FEED_CELEBRITY_FOLLOWERS
+BACKFILL_POSTS = settings.PER_PAGE
+BATCH_SIZE = 1000
+PULL_AUTHORS_KEY = 'timeline:pull_authors'
+
+# Каждый источник читается своим подзапросом с LIMIT по индексу
+# ({field}, -pub_date), подзапросы склеиваются через UNION ALL
+STREAM_HEAD_SQL = '''
+    SELECT * FROM (
+        SELECT {field}, pub_date, id FROM {posts}
+        WHERE {field} = %s {condition}
+        ORDER BY pub_date DESC, id DESC
+        LIMIT {limit:d}
+    ) head
+'''
+# Подзапросов в одном UNION ALL (у SQLite предел - 500)
+SOURCES_PER_QUERY = 200
+
+
+UNPUSHED_AUTHORS_SQL = '''
+    SELECT DISTINCT author_id FROM {posts} WHERE {condition}
+'''
+
+
+def unpushed_condition():
+    # литерал, а не параметр: иначе SQLite не сопоставит условие
+    # с частичным индексом post_unpushed_author_idx
+    return f'pushed = {connection.schema_editor().quote_value(False)}'
+
+
+def pull_author_ids():
+    """Авторы, у которых есть неразосланные посты: знаменитости и
+    бывшие знаменитости. Читается по частичному индексу и кешируется,
+    новый неразосланный пост сбрасывает кеш (forget_pull_authors)."""
+    def load():
+        sql = UNPUSHED_AUTHORS_SQL.format(
+            posts=Post._meta.db_table, condition=unpushed_condition()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return frozenset(row[0] for row in cursor.fetchall())
+    return cache.get_or_set(
+        PULL_AUTHORS_KEY, load, counters.COUNT_CACHE_TIMEOUT
+    )
+
+
+def forget_pull_authors():
+    cache.delete(PULL_AUTHORS_KEY)
+
+
+def stream_heads(field, source_ids, limit, unpushed=False):
+    """Первые ``limit`` ключей (pub_date, id) каждого источника, при
+    ``unpushed`` - только среди неразосланных постов."""
+    if not source_ids or not limit:
+        return []
+    condition = f'AND {unpushed_condition()}' if unpushed else ''
+    head_sql = STREAM_HEAD_SQL.format(
+        field=field, posts=Post._meta.db_table, limit=limit,
+        condition=condition,
+    )
+    streams = {}
+    with connection.cursor() as cursor:
+        for start in range(0, len(source_ids), SOURCES_PER_QUERY):
+            chunk = source_ids[start:start + SOURCES_PER_QUERY]
+            cursor.execute(' UNION ALL '.join([head_sql] * len(chunk)), chunk)
+            for source_id, pub_date, post_id in cursor.fetchall():
+                streams.setdefault(source_id, []).append((pub_date, post_id))
+    return list(streams.values())
+
+
+TIMELINE_SQL = '''
+    SELECT pub_date, post_id FROM {timeline}
+    WHERE user_id = %s
+    ORDER BY pub_date DESC, post_id DESC
+    LIMIT %s
+'''
+
+
+def timeline_head(user_id, limit):
+    sql = TIMELINE_SQL.format(timeline=TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, limit])
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def is_celebrity(author_id):
+    count = counters.follower_counts([author_id])[author_id]
+    return count >= CELEBRITY_FOLLOWERS
+
+
+def _bulk_push(entries):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def push_post(post):
+    """Рассылает новый пост подписчикам, если он отмечен к рассылке;
+    иначе автор попадает в pull_author_ids."""
+    if not post.pushed:
+        forget_pull_authors()
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_push(
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in follower_ids.iterator()
+    )
+
+
+def backfill(user, author_ids):
+    """Новый подписчик получает в ленту первую страницу уже разосланных
+    постов авторов, чтобы подписка в запросе не копировала всю историю;
+    неразосланные он прочитает через pull."""
+    if not author_ids:
+        return
+    posts = Post.objects.filter(
+        author_id__in=author_ids, pushed=True
+    ).order_by('-pub_date', '-id').values_list('id', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts[:BACKFILL_POSTS]
+        ],
+        ignore_conflicts=True
+    )
+
+
+def forget(user, author_ids):
+    TimelineEntry.objects.filter(
+        user=user, post__author_id__in=author_ids
+    ).delete()
+
+
+def merge_streams(streams):
+    """k-путевое слияние убывающих потоков без повторов постов."""
+    last_id = None
+    for pub_date, post_id in heapq.merge(*streams, reverse=True):
+        if post_id != last_id:
+            yield post_id
+        last_id = post_id
+
+
+class FollowFeed:
+    """Лента подписок для Paginator: count() и срезы как у FeedRows."""
+
+    ordered = True
+
+    def __init__(self, user, with_comments=False):
+        self.user = user
+        self.with_comments = with_comments
+        self.author_ids = list(follows.followed_author_ids(user.id))
+        self.group_ids = list(
+            GroupFollow.objects.filter(user=user).values_list(
+                'group_id', flat=True
+            )
+        )
+
+    def sources(self):
+        return Q(author_id__in=self.author_ids) | Q(
+            group_id__in=self.group_ids
+        )
+
+    def count(self):
+        total = sum(counters.author_post_counts(self.author_ids).values())
+        if self.group_ids:
+            total += sum(
+                counters.group_post_counts(self.group_ids).values()
+            )
+            if self.author_ids:
+                total -= self.overlap_count()
+        return total
+
+    def overlap_count(self):
+        """Посты избранных авторов в избранных группах. Ключ кеша - от
+        набора подписок, так что подписка или отписка сразу дают новый
+        ключ, а новые посты учитываются через COUNT_CACHE_TIMEOUT."""
+        sources = f'{sorted(self.author_ids)}:{sorted(self.group_ids)}'
+        digest = hashlib.md5(sources.encode()).hexdigest()
+        return cache.get_or_set(
+            f'follow_feed_overlap:user:{self.user.id}:{digest}',
+            Post.objects.filter(
+                author_id__in=self.author_ids,
+                group_id__in=self.group_ids,
+            ).count,
+            counters.COUNT_CACHE_TIMEOUT
+        )
+
+    def __len__(self):
+        return self.count()
+
+    def __contains__(self, post):
+        return Post.objects.filter(self.sources(), pk=post.pk).exists()
+
+    def pull_ids(self):
+        pulled = pull_author_ids()
+        return [pk for pk in self.author_ids if pk in pulled]
+
+    def post_ids(self, start, stop):
+        streams = (
+            [timeline_head(self.user.id, stop)]
+            + stream_heads(
+                'author_id', self.pull_ids(), stop, unpushed=True
+            )
+            + stream_heads('group_id', self.group_ids, stop)
+        )
+        return list(islice(merge_streams(streams), start, stop))
+
+    def load(self, post_ids):
+        rows = {
+            row.id: row for row in load_feed_rows(
+                Post.objects.filter(id__in=post_ids), self.with_comments
+            )
+        }
+        return [rows[post_id] for post_id in post_ids]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.load(self.post_ids(key.start or 0, key.stop))
+        return self.load(self.post_ids(key, key + 1))[0]
+
+    def __iter__(self):
+        return iter(self[:self.count()])
@@ -0,0 +1,77 @@
+"""Популярное: посты и сообщества по затухающему счёту активности.
+
+Событие (пост или комментарий) с весом w в момент t добавляет к счёту
+w·exp(λ·t), где λ = ln 2 / TREND_HALF_LIFE. К моменту now настоящий
+вклад события - w·exp(λ·(t - now)); множитель exp(-λ·now) общий для
+всех строк и порядок не меняет, поэтому хранимый счёт только растёт и
+никогда не пересчитывается по всей таблице комментариев.
+
+Чтобы exp(λ·t) не переполнялся, хранится логарифм суммы, а событие
+прибавляется одним UPDATE:
+log(e^a + e^b) = max(a, b) + ln(1 + e^-|a - b|).
+Топ читается по индексу на -trend_score, то есть за O(k).
+"""
+import math
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .models import Group, Post
+
+DECAY = math.log(2) / settings.TREND_HALF_LIFE
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+POST_WEIGHT = 3
+COMMENT_WEIGHT = 1
+
+
+def log_weight(weight, moment):
+    return math.log(weight) + DECAY * (moment - EPOCH).total_seconds()
+
+
+def log_sum(values):
+    """log(Σ e^v) без переполнения."""
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def log_add(field, value):
+    """Выражение log(e^field + e^value) для UPDATE."""
+    value = Value(value, output_field=FloatField())
+    return Greatest(F(field), value) + Ln(
+        Value(1.0) + Exp(-Abs(F(field) - value))
+    )
+
+
+def current_score(score, now=None):
+    """Сумма весов событий с учётом затухания к моменту ``now``."""
+    now = now or timezone.now()
+    return math.exp(score - DECAY * (now - EPOCH).total_seconds())
+
+
+def record_post(post):
+    """Новый пост: его начальный счёт и вклад в счёт сообщества."""
+    if post.group_id is not None:
+        Group.objects.filter(pk=post.group_id).update(
+            trend_score=log_add('trend_score', post.trend_score)
+        )
+
+
+def record_comment(comment):
+    value = log_weight(COMMENT_WEIGHT, comment.created)
+    Post.objects.filter(pk=comment.post_id).update(
+        trend_score=log_add('trend_score', value)
+    )
+    Group.objects.filter(posts=comment.post_id).update(
+        trend_score=log_add('trend_score', value)
+    )
+
+
+def trending_posts(limit=settings.TRENDING_POSTS):
+    return Post.objects.order_by('-trend_score')[:limit]
+
+
+def trending_groups(limit=settings.TRENDING_GROUPS):
+    return Group.objects.order_by('-trend_score')[:limit]
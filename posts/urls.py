@@ -4,6 +4,10 @@ from . import views
 
 urlpatterns = [
     path("follow/", views.follow_index, name="follow_index"),
+    path("follow/bulk/", views.follow_bulk, name="follow_bulk"),
+    path("posts/new/", views.new_posts_count, name="new_posts_count"),
+    path("trending/", views.trending, name="trending"),
+    path("mentions/", views.mentions, name="mentions"),
     path(
         "<str:username>/follow/",
         views.profile_follow,
@@ -17,7 +21,19 @@ urlpatterns = [
 
     path('', views.index, name='index'),
     path('new/', views.new_post, name='post_new'),
+    path('group/', views.group_list, name='group_list'),
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
+    path(
+        'group/<slug:slug>/follow/',
+        views.group_follow,
+        name='group_follow'
+    ),
+    path(
+        'group/<slug:slug>/unfollow/',
+        views.group_unfollow,
+        name='group_unfollow'
+    ),
+    path('tag/<str:name>/', views.tag_posts, name='tag_posts'),
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
     path(
@@ -34,4 +50,9 @@ urlpatterns = [
         views.add_comment,
         name="add_comment"
     ),
+    path(
+        "<username>/<int:post_id>/comments/stream/",
+        views.comments_stream,
+        name="comments_stream"
+    ),
 ]
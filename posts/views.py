@@ -1,12 +1,30 @@
+from functools import partial
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Max
+from django.http import (HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
 
+from . import counters, follows, live, tags
+from .feeds import FeedRows, load_feed_rows
+from .follows import following_ids, mark_following
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Group, GroupFollow, Mention, Post, Tag, User
+from .pagination import paginate
+from .related import related_posts
+from .text import normalize_tag
+from .timeline import FollowFeed
+from .trending import trending_groups, trending_posts
+
+NEW_POSTS_LIMIT = settings.NEW_POSTS_LIMIT
 
-PER_PAGE = settings.PER_PAGE
+
+def wants_json(request):
+    return 'application/json' in request.META.get('HTTP_ACCEPT', '')
 
 
 def page_not_found(request, exception):
@@ -22,6 +40,50 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+def new_posts_count(request):
+    """Сколько постов ленты новее поста ``since`` (не больше
+    NEW_POSTS_LIMIT). Если ``since`` не меньше водяного знака ленты из
+    общего кеша, ответ дается без запросов к постам. Водяной знак из
+    кеша одного процесса мог устареть, поэтому тогда он берётся из БД."""
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return HttpResponseBadRequest()
+    feed = request.GET.get('feed', 'index')
+    if feed == 'index':
+        watermark = counters.post_watermark
+        posts = Post.objects.all()
+    elif feed == 'group':
+        group = get_object_or_404(Group, slug=request.GET.get('slug'))
+        watermark = partial(counters.group_watermark, group.id)
+        posts = group.posts.all()
+    elif feed == 'profile':
+        author = get_object_or_404(
+            User, username=request.GET.get('username')
+        )
+        watermark = partial(counters.author_watermark, author.id)
+        posts = author.posts.all()
+    elif feed == 'follow' and request.user.is_authenticated:
+        follow_feed = FollowFeed(request.user)
+        watermark = partial(
+            counters.follow_watermark,
+            follow_feed.author_ids, follow_feed.group_ids
+        )
+        posts = Post.objects.filter(follow_feed.sources())
+    else:
+        return HttpResponseBadRequest()
+    if counters.SHARED_CACHE:
+        latest = watermark()
+    else:
+        latest = posts.aggregate(latest=Max('id'))['latest'] or 0
+    count = 0
+    if since < latest:
+        count = posts.filter(id__gt=since).order_by()[
+            :NEW_POSTS_LIMIT
+        ].count()
+    return JsonResponse({'count': count, 'latest': latest})
+
+
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None)
@@ -33,10 +95,9 @@ def new_post(request):
 
 
 def index(request):
-    post_list = Post.objects.select_related('group')
-    paginator = Paginator(post_list, PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = FeedRows(Post.objects.all(), with_comments=True)
+    paginator, page = paginate(request, post_list, counters.post_count())
+    mark_following(page.object_list, request.user)
     return render(
         request,
         'posts/index.html',
@@ -44,37 +105,90 @@ def index(request):
     )
 
 
+def trending(request):
+    """Популярные посты и сообщества - первые строки индексов по
+    trend_score."""
+    posts = load_feed_rows(trending_posts(), with_comments=True)
+    mark_following(posts, request.user)
+    return render(
+        request,
+        'posts/trending.html',
+        {'posts': posts, 'groups': trending_groups()}
+    )
+
+
+def group_list(request):
+    """Каталог сообществ с сохранёнными агрегатами (см. directory.py)."""
+    groups = Group.objects.only(
+        'title', 'slug', 'post_count', 'last_activity', 'subscriber_count'
+    ).order_by('-last_activity', 'id')
+    paginator, page = paginate(request, groups, counters.group_count())
+    return render(
+        request,
+        'posts/groups.html',
+        {'page': page, 'paginator': paginator}
+    )
+
+
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-
-    paginator = Paginator(posts, PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = FeedRows(group.posts.all(), with_comments=True)
+    following = request.user.is_authenticated and GroupFollow.objects.filter(
+        user=request.user, group=group
+    ).exists()
+    paginator, page = paginate(
+        request, posts, counters.group_post_count(group.id)
+    )
+    mark_following(page.object_list, request.user)
     return render(
         request,
         'group.html',
         {
             'group': group,
+            'following': following,
             'page': page,
             'paginator': paginator
         }
     )
 
 
+def tag_posts(request, name):
+    """Лента тега, листается курсором ``before`` (см. tags.py)."""
+    tag = get_object_or_404(Tag, name=normalize_tag(name))
+    posts, next_cursor = tags.tag_feed(
+        tag, tags.decode_cursor(request.GET.get('before'))
+    )
+    mark_following(posts, request.user)
+    return render(
+        request,
+        'posts/tag.html',
+        {'tag': tag, 'posts': posts, 'next_cursor': next_cursor}
+    )
+
+
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-
-    paginator = Paginator(post_list, PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    context = {'page': page, 'author': author, 'paginator': paginator}
+    post_list = FeedRows(author.posts.all())
+    paginator, page = paginate(
+        request, post_list, counters.author_post_count(author.id)
+    )
+    following = bool(following_ids(request.user, [author.id]))
+    # все карточки профиля - одного автора, проверка уже сделана
+    for row in page.object_list:
+        row.author.following = following
+    context = {
+        'page': page,
+        'author': author,
+        'paginator': paginator,
+        'following': following,
+        'suggestions': follows.suggested_authors(request.user),
+    }
     return render(request, 'posts/profile.html', context)
 
 
 def post_view(request, username, post_id):
     post = get_object_or_404(Post, id=post_id, author__username=username)
+    post.comment_count = counters.comment_counts([post.id])[post.id]
     form = CommentForm()
     comments = post.comments.all()
     return render(
@@ -83,12 +197,28 @@ def post_view(request, username, post_id):
         {
             'post': post,
             'author': post.author,
+            'following': bool(following_ids(request.user, [post.author_id])),
             'form': form,
             'comments': comments,
+            'related_posts': related_posts(post, settings.RELATED_POSTS),
         }
     )
 
 
+def comments_stream(request, username, post_id):
+    post = get_object_or_404(Post, id=post_id, author__username=username)
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID', '')
+    events = live.comment_events(
+        post.id, int(last_event_id) if last_event_id.isdigit() else None
+    )
+    response = StreamingHttpResponse(
+        events, content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, id=post_id, author__username=username)
@@ -114,27 +244,71 @@ def post_edit(request, username, post_id):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
     form = CommentForm(request.POST or None)
+    new_comment = None
     if form.is_valid():
         new_comment = form.save(commit=False)
         new_comment.author = request.user
         new_comment.post = post
         new_comment.save()
 
+    if wants_json(request):
+        if new_comment is None:
+            return JsonResponse(
+                {'errors': form.errors.get_json_data()}, status=400
+            )
+        return JsonResponse(
+            {
+                'id': new_comment.id,
+                'html': live.render_comment(new_comment),
+                'comment_count': counters.comment_counts([post.id])[post.id],
+            },
+            status=201
+        )
+    if request.is_ajax():
+        if new_comment is None:
+            return render(
+                request,
+                'posts/includes/comment_errors.html',
+                {'form': form},
+                status=400
+            )
+        return render(
+            request,
+            'posts/includes/comment_item.html',
+            {'item': new_comment},
+            status=201
+        )
     return redirect('post', username=username, post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-
-    paginator = Paginator(post_list, PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = FollowFeed(request.user, with_comments=True)
+    paginator, page = paginate(request, post_list, post_list.count())
+    mark_following(page.object_list, request.user)
     return render(
         request,
         'posts/follow.html',
+        {
+            'page': page,
+            'paginator': paginator,
+            'suggestions': follows.suggested_authors(request.user),
+        }
+    )
+
+
+@login_required
+def mentions(request):
+    """Уведомления об упоминаниях пользователя, новые сначала."""
+    mention_list = Mention.objects.filter(user=request.user).select_related(
+        'author', 'post__author', 'comment'
+    ).order_by('-created', '-id')
+    paginator, page = paginate(request, mention_list, mention_list.count())
+    return render(
+        request,
+        'posts/mentions.html',
         {'page': page, 'paginator': paginator}
     )
 
@@ -142,14 +316,61 @@ def follow_index(request):
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-
-    if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+    follows.follow(request.user, [author.id])
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user, author=author).delete()
+    follows.unfollow(request.user, [author.id])
     return redirect('profile', username=username)
+
+
+@login_required
+@require_POST
+def follow_bulk(request):
+    """Подписка и отписка сразу от многих авторов в одной транзакции.
+
+    Принимает списки имён пользователей в полях ``follow`` и
+    ``unfollow`` и возвращает имена авторов, на которых пользователь
+    подписан после изменений."""
+    to_follow = request.POST.getlist('follow')
+    to_unfollow = request.POST.getlist('unfollow')
+    authors = dict(
+        User.objects.filter(
+            username__in=to_follow + to_unfollow
+        ).values_list('username', 'id')
+    )
+    with transaction.atomic():
+        follows.follow(
+            request.user,
+            [authors[name] for name in to_follow if name in authors]
+        )
+        follows.unfollow(
+            request.user,
+            [authors[name] for name in to_unfollow if name in authors]
+        )
+    followed = follows.followed_author_ids(request.user.id)
+    return JsonResponse({
+        'following': sorted(
+            name for name, pk in authors.items() if pk in followed
+        )
+    })
+
+
+@login_required
+def group_follow(request, slug):
+    # get_or_create переживает повторный клик: при нарушении
+    # unique_group_follows он читает уже созданную подписку, а счётчик
+    # подписчиков меняют сигналы только для новой строки
+    group = get_object_or_404(Group, slug=slug)
+    GroupFollow.objects.get_or_create(user=request.user, group=group)
+    return redirect('group_posts', slug=slug)
+
+
+@login_required
+def group_unfollow(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    GroupFollow.objects.filter(user=request.user, group=group).delete()
+    return redirect('group_posts', slug=slug)
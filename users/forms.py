@@ -1,10 +1,40 @@
+from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from django.urls import Resolver404, resolve, reverse
 
 User = get_user_model()
 
+# Адреса пользователя, которые должны вести на его страницы: имя вроде
+# "trending" или "group" занято разделом сайта и профиль бы не открылся
+USER_URLS = [
+    ('profile', []),
+    ('profile_follow', []),
+    ('post', [1]),
+]
+
+
+def username_reserved(username):
+    """Перехвачен ли какой-нибудь адрес пользователя другим маршрутом."""
+    for name, args in USER_URLS:
+        try:
+            match = resolve(reverse(name, args=[username, *args]))
+        except Resolver404:
+            return True
+        if match.url_name != name:
+            return True
+    return False
+
 
 class CreationForm(UserCreationForm):
     class Meta:
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        if username_reserved(username):
+            raise forms.ValidationError(
+                'Это имя занято разделом сайта, выберите другое.'
+            )
+        return username
@@ -0,0 +1,127 @@
+"""Раздача загруженных файлов (MEDIA_ROOT) в production.
+
+Оригиналы картинок и миниатюры sorl-thumbnail отдаются с сильным ETag,
+Last-Modified и долгим Cache-Control, с поддержкой If-None-Match и
+одного диапазона байт (Range). При MEDIA_OFFLOAD сам файл отдаёт
+веб-сервер по заголовку X-Accel-Redirect (nginx) или X-Sendfile
+(Apache, lighttpd), и Python-воркер освобождается сразу после проверки
+прав и заголовков; без него целый файл уходит через FileResponse
+(wsgi.file_wrapper, то есть sendfile у большинства серверов).
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+CHUNK_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def requested_range(request, size, etag):
+    """(start, end) из заголовка Range или None, если нужен весь файл.
+
+    Несколько диапазонов сразу не поддерживаются - тогда файл
+    отдаётся целиком, что RFC 7233 допускает."""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        # bytes=-N - последние N байт
+        if not int(end):
+            raise RangeNotSatisfiable
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            data = source.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def offload(path, fullpath):
+    response = HttpResponse()
+    if settings.MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = quote(
+            settings.MEDIA_OFFLOAD_PREFIX + path
+        )
+    else:
+        response['X-Sendfile'] = fullpath
+    return response
+
+
+def file_response(request, fullpath, size, etag):
+    try:
+        byte_range = requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        return FileResponse(open(fullpath, 'rb'))
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        read_range(fullpath, start, end - start + 1), status=206
+    )
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+@require_safe
+def serve(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+    etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_OFFLOAD:
+        response = offload(path, fullpath)
+    else:
+        response = file_response(
+            request, fullpath, file_stat.st_size, etag
+        )
+    if response.status_code in (200, 206):
+        response['Content-Type'] = (
+            mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+        )
+        response['Last-Modified'] = http_date(file_stat.st_mtime)
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = f'public, max-age={settings.MEDIA_MAX_AGE}'
+    return response
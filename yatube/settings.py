@@ -1,4 +1,5 @@
 import os
+import sys
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -8,6 +9,43 @@ DEBUG = True
 
 PER_PAGE = 10
 
+PREVIEW_LENGTH = 300
+
+COMMENT_PREVIEWS = 3
+
+# Больше этого числа новых постов опрос ленты не досчитывает
+NEW_POSTS_LIMIT = 100
+
+# Период (в секундах) проверки новых комментариев для SSE
+LIVE_COMMENTS_INTERVAL = 2
+
+# Период (в секундах) записи накопленных уведомлений об упоминаниях
+MENTION_NOTIFY_INTERVAL = 1
+
+# Посты авторов с таким числом подписчиков не рассылаются по лентам,
+# а подтягиваются при чтении ленты подписок
+FEED_CELEBRITY_FOLLOWERS = 10000
+
+# Счётчики, водяные знаки и подписки в кеше сдвигаются записью в том
+# процессе, где она случилась, поэтому долго хранить их можно только в
+# общем для всех процессов кеше (MEMCACHED_LOCATION). В кеше одного
+# процесса они живут LOCAL_CACHE_TIMEOUT секунд.
+COUNT_CACHE_TIMEOUT = 60 * 60
+LOCAL_CACHE_TIMEOUT = 10
+
+# Сколько рекомендаций «на кого подписаться» показывать и сколько
+# хранить на пользователя после ночного расчёта
+FOLLOW_SUGGESTIONS = 5
+FOLLOW_SUGGESTIONS_STORED = 20
+
+# Период полураспада (в секундах) счёта активности в «Популярном»
+TREND_HALF_LIFE = 24 * 60 * 60
+TRENDING_POSTS = 10
+TRENDING_GROUPS = 10
+
+# Сколько похожих постов хранить и показывать под постом
+RELATED_POSTS = 5
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -32,6 +70,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'yatube.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,9 +137,22 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# Собирается командой build_static, см. yatube/staticfiles.py
+STATICFILES_STORAGE = 'yatube.staticfiles.CompressedManifestStaticFilesStorage'
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+# Ссылка на файл, которого нет в манифесте, - ошибка. Тесты рендерят
+# шаблоны с DEBUG = False без собранной статики, им это не нужно.
+STATICFILES_MANIFEST_STRICT = not (
+    sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+)
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Кто отдаёт файлы из MEDIA_ROOT: '' - сам Django, 'x-accel-redirect'
+# (nginx, internal location MEDIA_OFFLOAD_PREFIX) или 'x-sendfile'
+MEDIA_OFFLOAD = ''
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+MEDIA_MAX_AGE = 30 * 24 * 60 * 60
 
 SITE_ID = 1
 
@@ -114,8 +166,18 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+MEMCACHED_LOCATION = os.environ.get('MEMCACHED_LOCATION')
+
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
@@ -0,0 +1,156 @@
+"""Собранная статика: хеши в именах, заранее сжатые копии и раздача.
+
+CompressedManifestStaticFilesStorage после хеширования имён кладёт
+рядом с каждым текстовым файлом .gz (и .br, если установлен brotli).
+StaticFilesMiddleware при старте один раз читает манифест, а на запрос
+отдаёт подходящую по Accept-Encoding готовую копию с заголовками
+«кешировать навсегда» - сжатие на каждый запрос не выполняется.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = (
+    '.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml',
+    '.eot', '.ttf', '.otf',
+)
+# Копия, сжатая хуже этой доли оригинала, не сохраняется
+MIN_RATIO = 0.95
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data)
+
+
+ENCODERS = [('br', '.br', _brotli)] if brotli else []
+ENCODERS.append(('gzip', '.gz', _gzip))
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    @property
+    def manifest_strict(self):
+        # без записи в манифесте - ошибка, а не ссылка на файл без хеша;
+        # в тестах статику не собирают, там проверка отключена
+        return settings.STATICFILES_MANIFEST_STRICT
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed = {}
+        for name, hashed_name, processed in super().post_process(
+            paths, dry_run, **options
+        ):
+            hashed[name] = hashed_name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in hashed.values():
+            if hashed_name and hashed_name.endswith(COMPRESSIBLE):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        """Сохраняет сжатые копии файла, которые меньше оригинала."""
+        with open(self.path(name), 'rb') as source:
+            data = source.read()
+        written = []
+        for _, suffix, encode in ENCODERS:
+            compressed = encode(data)
+            if len(compressed) < len(data) * MIN_RATIO:
+                with open(self.path(name + suffix), 'wb') as target:
+                    target.write(compressed)
+                written.append(name + suffix)
+        return written
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding, кроме запрещённых через q=0."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFile:
+    __slots__ = ('path', 'content_type', 'variants')
+
+    def __init__(self, path):
+        self.path = path
+        self.content_type = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        )
+        self.variants = [
+            (encoding, path + suffix)
+            for encoding, suffix, _ in ENCODERS
+            if os.path.exists(path + suffix)
+        ]
+
+    def response(self, request):
+        accepted = accepted_encodings(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        path, encoding = self.path, None
+        for variant_encoding, variant_path in self.variants:
+            if variant_encoding in accepted:
+                path, encoding = variant_path, variant_encoding
+                break
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=self.content_type)
+            response['Content-Length'] = os.path.getsize(path)
+        else:
+            response = FileResponse(
+                open(path, 'rb'), content_type=self.content_type
+            )
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if self.variants:
+            response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = (
+            f'public, max-age={settings.STATIC_MAX_AGE}, immutable'
+        )
+        return response
+
+
+class StaticFilesMiddleware:
+    """Раздаёт файлы с хешем в имени по манифесту собранной статики."""
+
+    def __init__(self, get_response):
+        if not isinstance(staticfiles_storage, ManifestStaticFilesStorage):
+            raise MiddlewareNotUsed
+        hashed_files = staticfiles_storage.load_manifest()
+        if not hashed_files:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.files = {
+            posixpath.join(settings.STATIC_URL, hashed_name):
+                StaticFile(staticfiles_storage.path(hashed_name))
+            for hashed_name in hashed_files.values()
+        }
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD'):
+            static_file = self.files.get(request.path_info)
+            if static_file is not None:
+                return static_file.response(request)
+        return self.get_response(request)
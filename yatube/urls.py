@@ -1,13 +1,22 @@
+import re
+
 from django.conf import settings
 from django.conf.urls import handler404, handler500
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from yatube import media
 
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
 urlpatterns = [
+    re_path(
+        r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+        media.serve,
+        name='media'
+    ),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path('', include('posts.urls')),
@@ -16,10 +25,6 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(
-        settings.MEDIA_URL,
-        document_root=settings.MEDIA_ROOT
-    )
     urlpatterns += static(
         settings.STATIC_URL,
         document_root=settings.STATIC_ROOT